@@ -11,20 +11,353 @@
 import numpy as np
 from scipy.ndimage.filters import uniform_filter1d
 
+# ragged hit table returned by Algos.get_hits, one row per hit (times in samples)
+HIT_DTYPE = np.dtype([('event',     'i4'),
+                      ('channel',   'i4'),
+                      ('start',     'i4'),
+                      ('stop',      'i4'),
+                      ('peak',      'i4'),
+                      ('amplitude', 'f4'),
+                      ('integral',  'f8')])
+
+# pulse table returned by Algos.get_pulses, one row per pulse (times in samples)
+PULSE_DTYPE = np.dtype([('event',    'i4'),
+                        ('start',    'i4'),
+                        ('end',      'i4'),
+                        ('integral', 'f8'),
+                        ('width',    'f4'),
+                        ('fprompt',  'f4'),
+                        ('type',     'i1')])  # 1: S1, 2: S2
+
+# cluster table returned by Algos.get_clusters, one row per cluster (times in samples)
+CLUSTER_DTYPE = np.dtype([('event',    'i4'),
+                          ('start',    'i4'),
+                          ('duration', 'i4'),
+                          ('charge',   'f8'),   # sum of the hit integrals (ADC x samples)
+                          ('nhits',    'i4')])
+
+
+class PrefixSums:
+  """Cumulative sums of a set of waveforms, (channel, sample) or (event, channel, sample),
+  to integrate any number of windows in O(1) each.
+  Integer waveforms are accumulated in int64 (exact), others in float64.
+  'out' is an optional preallocated array of shape wfs.shape[:-1] + (samples+1,) to reuse.
+  Usage:
+    ps = PrefixSums(wfs)
+    q  = ps.integrate(channels, starts, stops)          # (channel, sample) wfs
+    q  = ps.integrate(channels, starts, stops, events)  # (event, channel, sample) wfs
+  """
+
+  def __init__(self, wfs, out=None):
+    wfs   = np.asarray(wfs)
+    dtype = np.int64 if np.issubdtype(wfs.dtype, np.integer) else np.float64
+    shape = wfs.shape[:-1] + (wfs.shape[-1] + 1,)
+    if out is not None and (out.shape != shape or out.dtype != dtype):
+      raise ValueError(f'PrefixSums output must be {dtype.__name__} {shape}, got {out.dtype} {out.shape}')
+    self.samples = wfs.shape[-1]
+    self.cum     = np.empty(shape, dtype=dtype) if out is None else out
+    self.cum[..., 0] = 0
+    np.cumsum(wfs, axis=-1, dtype=dtype, out=self.cum[..., 1:])
+
+  def integrate(self, channels, starts, stops, events=None):
+    """Return the sums over [start, stop) of the given channels (and events), arguments broadcast together.
+    Windows are clipped to the waveform, empty windows integrate to 0.
+    """
+    starts = np.clip(starts, 0, self.samples)
+    stops  = np.clip(stops, starts, self.samples)
+    if events is None:
+      return self.cum[channels, stops] - self.cum[channels, starts]
+    return self.cum[events, channels, stops] - self.cum[events, channels, starts]
+
+  def windows(self, starts, stops):
+    """Return the sums over [start, stop) for every channel (and event), shaped wfs.shape[:-1] + starts.shape."""
+    starts = np.clip(starts, 0, self.samples)
+    stops  = np.clip(stops, starts, self.samples)
+    return self.cum[..., stops] - self.cum[..., starts]
+
+
+# Sum of blocks of r samples along the last axis with one reshape,
+# the leftover samples make a last partial bin if partial, else are dropped.
+# Integer waveforms are summed in int64 (exact), others in float64.
+def rebin_sum(wfs, r, partial=True):
+  wfs   = np.asarray(wfs)
+  dtype = np.int64 if np.issubdtype(wfs.dtype, np.integer) else np.float64
+  n, r  = wfs.shape[-1], int(r)
+  m     = n - n % r
+  out   = wfs[..., :m].reshape(wfs.shape[:-1] + (m//r, r)).sum(axis=-1, dtype=dtype)
+  if partial and m < n:
+    out = np.concatenate((out, wfs[..., m:].sum(axis=-1, dtype=dtype, keepdims=True)), axis=-1)
+  return out
+
+
+# Number of samples in each bin of rebin_sum(wfs, r, partial=True) for n samples
+def rebin_widths(n, r):
+  return np.minimum(r, n - np.arange(0, n, r))
+
+
+class Rebinner:
+  """Sum or mean of blocks of 'rebin' samples of waveforms arriving in consecutive
+  chunks along the sample axis (e.g. a long gate read in several batches).
+  The samples left at the end of a chunk are completed by the next one, so the
+  output does not depend on how the waveforms were cut.
+  Usage:
+    rb  = Rebinner(rebin=8, mode='mean')
+    out = [rb(chunk) for chunk in chunks]  # (..., bins completed so far)
+    out.append(rb.flush())                 # partial last bin, (..., 0 or 1)
+  """
+
+  def __init__(self, rebin, mode='mean'):
+    if mode not in ('sum', 'mean'):
+      raise ValueError(f"Rebin mode '{mode}' not implemented.")
+    self.rebin = int(rebin)
+    self.mode  = mode
+    self.rest  = None
+
+  def __call__(self, chunk):
+    x = np.asarray(chunk) if self.rest is None else np.concatenate((self.rest, chunk), axis=-1)
+    m = x.shape[-1] - x.shape[-1] % self.rebin
+    self.rest = x[..., m:]
+    out = rebin_sum(x[..., :m], self.rebin)
+    return out/self.rebin if self.mode == 'mean' else out
+
+  def flush(self):
+    """Return the partial last bin (empty if none) and reset the leftover samples."""
+    rest, self.rest = self.rest, None
+    if rest is None: return np.zeros(0)
+    if rest.shape[-1] == 0: return np.zeros(rest.shape[:-1] + (0,))
+    out = rest.sum(axis=-1, keepdims=True, dtype=np.float64)
+    return out/rest.shape[-1] if self.mode == 'mean' else out
+
+
+class Pyramid:
+  """Successive 2x rebinned levels of a set of waveforms (..., sample), computed on demand and cached.
+  Level k holds the mean of bins of 2**k samples (level 0 is the input, the last
+  bin may be partial), so amplitudes compare across levels and a coarse search
+  on a long gate only needs the full resolution in the windows it selects.
+  Usage:
+    pyr = Pyramid(wfs)
+    coarse = pyr[3]                           # 8x fewer samples
+    lo, hi = pyr.to_samples(3, starts, stops) # full resolution window of coarse bins [starts, stops)
+  """
+
+  def __init__(self, wfs, levels=3):
+    self.wfs     = np.asarray(wfs)
+    self.levels  = levels
+    self.samples = self.wfs.shape[-1]
+    self.sums    = {0: self.wfs}
+
+  def __getitem__(self, k):
+    if not 0 <= k <= self.levels:
+      raise IndexError(f'Pyramid level {k} out of range [0, {self.levels}]')
+    if k == 0: return self.wfs
+    return self.sum(k)/rebin_widths(self.samples, 1 << k)
+
+  def sum(self, k):
+    """Return the sums of the bins of level k, each level built from the previous one."""
+    if k not in self.sums:
+      self.sums[k] = rebin_sum(self.sum(k - 1), 2)
+    return self.sums[k]
+
+  def to_samples(self, k, starts, stops):
+    """Return the sample windows [lo, hi) covered by the bins [starts, stops) of level k."""
+    return np.minimum(np.asarray(starts) << k, self.samples), np.minimum(np.asarray(stops) << k, self.samples)
+
+
 class Algos:
   def __init__(self):
     print('Reconstruction Algorithms: Activated')
 
-  # compute the rolling median over wfs of an event
+  # integrate any number of windows [starts, stops) of wfs, see PrefixSums.integrate
+  # prefix is the PrefixSums of wfs if already computed (e.g. shared with get_t0)
+  def get_integrals(self, wfs, channels, starts, stops, events=None, prefix=None):
+    prefix = PrefixSums(wfs) if prefix is None else prefix
+    return prefix.integrate(channels, starts, stops, events)
+
+  # compute the rolling mean over wfs of an event
   def running_mean(self, wfs, gate=100):
     if wfs.ndim > 1: return uniform_filter1d(wfs, size=gate, axis=1)
     return  uniform_filter1d(wfs, size=gate)
 
+  # compute the exact rolling median over wfs, 1d, 2d or 3d (..., sample)
+  # Parameters:
+  #    gate is the window size (lower median for even gates), edges padded with the edge values
+  #
+  # Sorted-block algorithm (J. Suomela, arXiv:1406.1717): the padded waveforms are cut in
+  # blocks of 'gate' samples, each block is sorted once (O(n log gate)) and every window
+  # is the tail of a block plus the head of the next one. Each pair of blocks keeps its
+  # elements in sorted doubly linked lists and two pointers whose cut holds the h+1
+  # smallest elements; sliding by one sample removes one element from the first list,
+  # re-inserts one in the second and moves the pointers by O(1) steps. All pairs of all
+  # waveforms are stepped together, so there are only 'gate' vectorized iterations.
+  def running_median(self, wfs, gate=100):
+    shape = wfs.shape
+    x     = np.asarray(wfs, dtype=np.float64).reshape(-1, shape[-1])
+    k     = int(gate)
+    h, n  = (k - 1)//2, shape[-1]
+    if k <= 1: return x.reshape(shape).copy()
+
+    # pad to nb blocks of k samples so that n windows start in the first nb-1 blocks
+    nb  = -(-n // k) + 1
+    x   = np.pad(x, ((0, 0), (h, nb*k - n - h)), mode='edge').reshape(len(x), nb, k)
+    order = np.argsort(x, axis=2, kind='stable')
+    val   = np.take_along_axis(x, order, axis=2)
+    rank  = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(1, k+1), axis=2)
+
+    # lanes: one per pair of consecutive blocks, lists with head 0 (-inf) and tail k+1 (+inf)
+    nl   = len(x)*(nb - 1)
+    off  = (np.arange(nl)*(k + 2)).reshape(-1, 1)
+    pad  = lambda a, lo, hi: np.concatenate((np.full((nl, 1), lo), a, np.full((nl, 1), hi)), axis=1)
+    aval = pad(val[:, :-1].reshape(nl, k), -np.inf, np.inf).ravel()
+    bval = pad(val[:, 1:].reshape(nl, k), -np.inf, np.inf).ravel()
+    arank, brank = rank[:, :-1].reshape(nl, k) + off, rank[:, 1:].reshape(nl, k) + off
+    link = np.arange(k + 2) + off
+    anext, aprev = (link + 1).ravel(), (link - 1).ravel()
+    bnext, bprev = anext.copy(), aprev.copy()
+
+    # second list starts empty: delete its elements in reverse time order (re-inserted in time order)
+    for s in range(k - 1, -1, -1):
+      r = brank[:, s]
+      bnext[bprev[r]], bprev[bnext[r]] = bnext[r], bprev[r]
+
+    pa, pb = off[:, 0] + h + 1, off[:, 0].copy()
+    out    = np.empty((nl, k))
+    out[:, 0] = aval[pa]
+    for s in range(1, k):
+      # slide: remove the oldest sample of the first block, insert one of the second
+      r, q = arank[:, s-1], brank[:, s-1]
+      need = (r <= pa).astype(int) - (q < pb)
+      pa   = np.where(r == pa, aprev[pa], pa)
+      anext[aprev[r]], aprev[anext[r]] = anext[r], aprev[r]
+      bnext[bprev[q]], bprev[bnext[q]] = q, q
+
+      # restore the size of the cut, then its ordering
+      na, nb_ = anext[pa], bnext[pb]
+      adv     = need > 0
+      pa = np.where(adv & (aval[na] <= bval[nb_]), na, pa)
+      pb = np.where(adv & (aval[na] > bval[nb_]), nb_, pb)
+      ret = need < 0
+      back_a = ret & (aval[pa] >= bval[pb])
+      pa, pb = np.where(back_a, aprev[pa], pa), np.where(ret & ~back_a, bprev[pb], pb)
+      while True:
+        fa = aval[pa] > bval[bnext[pb]]
+        fb = ~fa & (bval[pb] > aval[anext[pa]])
+        if not (fa.any() or fb.any()): break
+        pa = np.where(fa, aprev[pa], np.where(fb, anext[pa], pa))
+        pb = np.where(fa, bnext[pb], np.where(fb, bprev[pb], pb))
+      out[:, s] = np.maximum(aval[pa], bval[pb])
+
+    return out.reshape(-1, (nb - 1)*k)[:, :n].reshape(shape)
+
+  # compute an approximate rolling median over integer wfs (e.g. raw ADC counts), 1d, 2d or 3d
+  # Parameters:
+  #    gate is the window size in samples
+  #    step is the time resolution: medians are evaluated every 'step' samples
+  #         on windows made of whole steps, then linearly interpolated
+  #    nbins is the number of unit bins of the histograms, centered on the median
+  #         of each waveform; values outside are clipped, which keeps their rank.
+  #         Rows where a window median falls in the first or last bin (baseline drifting
+  #         by more than nbins/2 counts) are recomputed with running_median
+  #    chunk is the number of samples (rows x samples) processed at once, bounding memory
+  #
+  # Rows are processed in chunks; for each chunk one (row, bin) histogram of the current
+  # window is updated step by step (the samples of the step entering and of the step
+  # leaving, one bincount each) and the median is read on its cumulative sum. Memory is
+  # O(chunk + rows*nbins) and the cost O(samples + (samples/step)*rows*nbins).
+  # Exact for integer data apart from the quantization of the window in steps.
+  # It is faster than running_median for large gates (step >~ 8, e.g. gate >= 64 with the
+  # default step); for short gates use running_median.
+  def running_median_hist(self, wfs, gate=100, step=None, nbins=256, chunk=1 << 22):
+    shape = wfs.shape
+    x     = np.asarray(wfs).reshape(-1, shape[-1])
+    nrows, n = x.shape
+    step  = max(int(gate)//8, 1) if step is None else int(step)
+    half  = max(int(round(gate/step)), 1)//2
+    nst   = -(-n // step)
+    med   = np.empty((nrows, nst))
+    clip  = np.zeros(nrows, dtype=bool)  # rows with a median in an edge bin
+
+    for r0 in range(0, nrows, max(chunk//n, 1)):
+      xc = x[r0:r0 + max(chunk//n, 1)]
+      nr = len(xc)
+      lo = np.median(xc, axis=1).astype(np.int64) - nbins//2
+      b  = np.clip(xc - lo.reshape(-1, 1), 0, nbins - 1) + (np.arange(nr)*nbins).reshape(-1, 1)  # flat (row, bin)
+
+      # window of 2*half+1 steps centered on step j, clipped to the waveform
+      hist = np.zeros(nr*nbins, dtype=np.int64)
+      add  = lambda j: np.bincount(b[:, j*step:(j+1)*step].ravel(), minlength=nr*nbins)
+      for j in range(min(half + 1, nst)): hist += add(j)
+      for j in range(nst):
+        cb = np.cumsum(hist.reshape(nr, nbins), axis=1)
+        m  = np.count_nonzero(cb <= (cb[:, -1:] - 1)//2, axis=1)
+        med[r0:r0+nr, j] = lo + m
+        clip[r0:r0+nr]  |= (m == 0) | (m == nbins - 1)
+        if j + half + 1 < nst: hist += add(j + half + 1)
+        if j - half >= 0:      hist -= add(j - half)
+
+    # linear interpolation between step centers
+    t  = (np.arange(n) - (step - 1)/2)/step
+    i0 = np.clip(np.floor(t).astype(int), 0, nst - 1)
+    i1 = np.minimum(i0 + 1, nst - 1)
+    f  = np.clip(t - i0, 0, 1)
+    out = med[:, i0]*(1 - f) + med[:, i1]*f
+    if clip.any(): out[clip] = self.running_median(x[clip], gate)
+    return out.reshape(shape)
+
   # substract mean baseline inside the daq
   def get_baseline(self, wfs, gate=500, start=0):
     if wfs.ndim > 1: return np.mean(wfs[:,start:start+gate], axis=1).reshape((-1, 1))
     return np.mean(wfs[start:start+gate])
 
+  # robust baseline and rms from the histogram mode of integer wfs (e.g. raw ADC counts)
+  # Parameters:
+  #    wfs is 1d, 2d or 3d (..., sample) with integer values
+  #    gate, start define the samples used, as in get_baseline
+  #    nbins is the number of unit bins, centered on a coarse median of each waveform
+  #    nsigma is the half width of the truncation around the mode, in units of the
+  #           sigma estimated from the full width at half maximum
+  #
+  # One bincount fills the histograms of all waveforms; the mode is refined with a
+  # parabola through the three highest bins and the truncated mean and rms are
+  # computed on the bins around it, so pulses in the window do not bias the result.
+  # The cost grows with nbins: on 100 x 64 waveforms of 500 samples it takes 0.07 s
+  # with nbins=512 and 0.03 s with nbins=128, against 0.017 s for np.mean and np.std
+  # and 0.003 s for np.mean alone; use get_baseline where pulses are not expected.
+  # Return the baseline and rms, shaped as wfs[..., :1] (scalars for 1d wfs).
+  def get_baseline_mode(self, wfs, gate=500, start=0, nbins=512, nsigma=3):
+    x    = np.asarray(wfs[..., start:start+gate])
+    rows = x.reshape(-1, x.shape[-1])
+    nr   = len(rows)
+
+    # bins 1..nbins of each row, 0 and nbins+1 collect the values out of range
+    lo  = np.median(rows[:, ::8], axis=1).astype(np.int64).reshape(-1, 1) - nbins//2
+    b   = rows.astype(np.int32)
+    b  -= (lo - 1).astype(np.int32)
+    np.clip(b, 0, nbins + 1, out=b)
+    b  += (np.arange(nr, dtype=np.int32)*(nbins + 2)).reshape(-1, 1)
+    hst = np.bincount(b.ravel(), minlength=nr*(nbins + 2)).reshape(nr, nbins + 2)[:, 1:-1]
+
+    # mode with sub-bin interpolation
+    r    = np.arange(nr)
+    m    = np.clip(np.argmax(hst, axis=1), 1, nbins - 2)
+    h0, h1, h2 = (hst[r, m + i].astype(np.float64) for i in (-1, 0, 1))
+    den  = h0 - 2*h1 + h2
+    mode = m + np.clip(np.where(den < 0, 0.5*(h0 - h2)/np.where(den < 0, den, 1), 0), -0.5, 0.5)
+
+    # truncated mean and rms around the mode, on a band of bins around it only
+    sigma = np.maximum(np.count_nonzero(2*hst >= h1.reshape(-1, 1), axis=1)/2.355, 0.5)
+    half  = int(np.ceil(nsigma*sigma.max())) + 1
+    v     = m.reshape(-1, 1) + np.arange(-half, half + 1)
+    ok    = (v >= 0) & (v < nbins) & (np.abs(v - mode.reshape(-1, 1)) <= nsigma*sigma.reshape(-1, 1))
+    w     = np.where(ok, hst[r.reshape(-1, 1), np.clip(v, 0, nbins - 1)], 0)
+    norm  = np.maximum(w.sum(axis=1), 1)
+    mean  = np.sum(w*v, axis=1)/norm
+    rms   = np.sqrt(np.maximum(np.sum(w*v*v, axis=1)/norm - mean**2, 0))
+
+    shape = x.shape[:-1] + (1,)
+    if x.ndim == 1: return (mean + lo[:, 0])[0], rms[0]
+    return (mean + lo[:, 0]).reshape(shape), rms.reshape(shape)
+
   # return baseline subtracted waveforms
   def get_subtracted_waveform(self, wfs, gate=500, start=0):
     return self.get_baseline(wfs=wfs,gate=gate, start=0) - wfs
@@ -35,9 +368,15 @@ class Algos:
     return np.std(wfs[0:gate])
 
   # downsample wfs
+  # mean of blocks of 'rebin' samples (the last one may be partial), no aliasing
+  # of the noise as with decimation; see Rebinner for waveforms read in chunks
   def downsample_wf(self, wfs, rebin):
-    if wfs.ndim > 1: return wfs[:,::int(rebin)]
-    return wfs[::int(rebin)]
+    return rebin_sum(wfs, rebin)/rebin_widths(wfs.shape[-1], int(rebin))
+
+  # return the Pyramid of wfs with 'levels' 2x levels; keep it while working on the
+  # same event, its levels are computed once on first use
+  def get_pyramid(self, wfs, levels=3):
+    return Pyramid(wfs, levels)
 
   # rois with from_ and to_ in samples
   def get_roi(self, wfs, gate=500, start=0):
@@ -45,6 +384,74 @@ class Algos:
     return wfs[:,int(start):int(start+gate)]
 
 
+  # t0 as the first time the cumulative charge reaches 'cumfrac' of the total
+  # Parameters:
+  #    wfs is a set of baseline subtracted waveforms with positive pulses, (..., sample);
+  #        pass the channel-summed waveforms for one t0 per event
+  #    cumfrac is the fraction of the charge in [start, stop) ([reco] t0_cumfrac)
+  #    prefix is the PrefixSums of wfs if already computed, to share it with get_fprompt:
+  #        ps = PrefixSums(wfs); t0 = get_t0(wfs, prefix=ps); fp = get_fprompt(wfs, t0, prefix=ps)
+  #
+  # The crossing is searched on the prefix sums of all waveforms at once (argmax of the
+  # boolean crossing matrix, robust against noise making the sums non-monotonic) and
+  # linearly interpolated between samples. Return t0 in samples, shaped wfs.shape[:-1].
+  def get_t0(self, wfs, cumfrac=0.2, start=0, stop=None, prefix=None):
+    prefix = PrefixSums(wfs) if prefix is None else prefix
+    stop  = wfs.shape[-1] if stop is None else min(int(stop), wfs.shape[-1])
+    cum   = prefix.cum[..., int(start):stop+1]
+    level = (cum[..., :1] + cumfrac*(cum[..., -1:] - cum[..., :1])).astype(np.float64)
+    above = cum[..., 1:] >= level
+    i     = np.argmax(above, axis=-1)[..., np.newaxis]
+
+    # interpolate between the prefix sums before and after the crossing sample
+    c0, c1 = np.take_along_axis(cum, i, axis=-1), np.take_along_axis(cum, i + 1, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      frac = np.clip(np.where(c1 > c0, (level - c0)/(c1 - c0), 0), 0, 1)
+    return (start + i + frac)[..., 0]
+
+  # fprompt: charge in [t0+fprompt_from, t0+fprompt_to) over the charge in [t0+fprompt_from, stop)
+  # Parameters (in samples, see Config.pars.reco):
+  #    wfs as in get_t0, t0 from get_t0 (same leading shape)
+  #    fprompt_from, fprompt_to are the prompt window bounds relative to t0
+  #    stop is the end of the total integration (default: full gate)
+  #
+  # Both integrals are gathers on the prefix sums, passed as prefix to share them with get_t0.
+  def get_fprompt(self, wfs, t0, fprompt_from=-125, fprompt_to=11, stop=None, prefix=None):
+    ps   = PrefixSums(wfs) if prefix is None else prefix
+    stop = ps.samples if stop is None else min(int(stop), ps.samples)
+    t0   = np.floor(t0).astype(np.int64)[..., np.newaxis]
+    idx  = np.concatenate((t0 + int(round(fprompt_from)), t0 + int(round(fprompt_to)),
+                           np.full_like(t0, stop)), axis=-1)
+    q    = np.take_along_axis(ps.cum, np.clip(idx, 0, ps.samples), axis=-1).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      return (q[..., 1] - q[..., 0])/(q[..., 2] - q[..., 0])
+
+  # time over threshold of baseline subtracted wfs (positive pulses), (..., sample)
+  # Parameters:
+  #    rms is the baseline rms, broadcastable to wfs[..., :1] (e.g. from get_rms)
+  #    threshold is in units of rms ([reco] tot_threshold)
+  #
+  # Return, shaped wfs.shape[:-1]: the number of samples above threshold, the first
+  # crossing (-1 if none) and the length of the longest contiguous run above threshold.
+  # Runs are found on the flattened boolean matrix at once, no loop over channels.
+  def get_tot(self, wfs, rms, threshold=6):
+    above = wfs > threshold*np.asarray(rms)
+    shape, samples = above.shape[:-1], above.shape[-1]
+    above = above.reshape(-1, samples)
+    ntot  = np.count_nonzero(above, axis=1)
+    first = np.where(ntot > 0, np.argmax(above, axis=1), -1)
+
+    # run edges on rows padded with False on both sides
+    edges  = np.diff(np.pad(above, ((0, 0), (1, 1))).view(np.int8), axis=1).reshape(-1)
+    starts = np.flatnonzero(edges == 1)
+    length = np.flatnonzero(edges == -1) - starts
+    longest = np.zeros(len(above), dtype=np.int64)
+    if len(starts):
+      row = starts//(samples + 1)
+      idx = np.flatnonzero(np.r_[True, row[1:] != row[:-1]])
+      longest[row[idx]] = np.maximum.reduceat(length, idx)
+    return ntot.reshape(shape), first.reshape(shape), longest.reshape(shape)
+
   # Return an array of [chennal, start, stop]
   # Parameters:
   #    wfs is a set of waveforms with 0 or 1 values only
@@ -124,3 +531,181 @@ class Algos:
 
     segs = np.concatenate(segs).ravel()
     return segs.reshape(-1,3).astype(int)
+
+
+  # Return the hit table (see HIT_DTYPE) of a batch of waveforms
+  # Parameters:
+  #    wfs is a set of baseline subtracted waveforms with positive pulses,
+  #        (event, channel, sample) or (channel, sample) for a single event
+  #    rms is the baseline rms, broadcastable to wfs[..., :1] (e.g. from get_rms)
+  #    ma_gate is the size of the moving average used for the threshold
+  #    threshold is in units of rms
+  #    min_integral is the minimum integral of a hit
+  #    window is the maximum number of samples integrated from the hit start
+  #    smooth (optional) is a float32 array shaped as wfs receiving the moving average
+  #    prefix (optional) is the PrefixSums of wfs
+  #    (both let a caller reuse buffers between batches, see executor.py)
+  #
+  # Hits are the contiguous regions where the smoothed waveform is above threshold,
+  # found on the flattened array at once. Amplitude and peak time are taken from
+  # the raw waveform, integrals from prefix sums. No loop over channels or hits.
+  def get_hits(self, wfs, rms, ma_gate=100, threshold=5, min_integral=6, window=600, smooth=None, prefix=None):
+    if wfs.ndim == 2: wfs = wfs[np.newaxis]
+    nevs, nchs, samples = wfs.shape
+    smooth = uniform_filter1d(wfs, size=int(ma_gate), axis=-1, output=np.float32 if smooth is None else smooth)
+
+    # above threshold samples and their grouping in hits
+    pos = np.flatnonzero(smooth > threshold*np.asarray(rms))
+    if len(pos) == 0: return np.zeros(0, dtype=HIT_DTYPE)
+    new   = np.r_[True, (np.diff(pos) != 1) | (pos[1:] % samples == 0)]
+    first = np.flatnonzero(new)
+    last  = np.r_[first[1:], len(pos)] - 1
+
+    row   = pos[first] // samples
+    start = pos[first] % samples
+    stop  = pos[last] % samples + 1
+
+    # amplitude and first sample at the maximum of each hit
+    vals = wfs.reshape(-1)[pos]
+    amp  = np.maximum.reduceat(vals, first)
+    hit  = np.cumsum(new) - 1
+    peak = np.minimum.reduceat(np.where(vals == amp[hit], pos, pos[-1] + 1), first) % samples
+
+    # integral over [start, min(stop, start+window)) with prefix sums
+    ev, ch   = np.divmod(row, nchs)
+    prefix   = PrefixSums(wfs) if prefix is None else prefix
+    integral = prefix.integrate(ch, start, np.minimum(stop, start + int(window)), ev)
+
+    hits = np.zeros(len(first), dtype=HIT_DTYPE)
+    hits['event'], hits['channel'] = ev, ch
+    hits['start'], hits['stop'], hits['peak'] = start, stop, peak
+    hits['amplitude'], hits['integral'] = amp, integral
+    return hits[integral >= min_integral]
+
+
+  # Return the pulse table (see PULSE_DTYPE) of the channel-summed waveforms
+  # Parameters (times in samples, see Config.pars.pulse_finding):
+  #    wfs is a set of waveforms, (event, channel, sample) or (channel, sample)
+  #    width is the smoothing width of the derivative
+  #    s1_min is the minimum integral of a pulse over the rolling window, in units of wfs (summed ADC counts)
+  #    rolling is the rolling window integral used to find the pulse extension
+  #    s1_window, s2_window are the prompt and total windows of the fprompt ratio
+  #    pre_gate is the number of samples kept before the rising edge
+  #    threshold is the rising edge threshold, in rms of the derivatives in [0, bl_gate)
+  #    s1_fprompt is the prompt fraction above which a pulse is an S1
+  #    polarity is 1 for positive pulses, -1 for negative ones
+  #
+  # A pulse extends while the integral over the next 'rolling' samples is above
+  # s1_min (summed ADC counts); its start is the first rising edge in that range,
+  # found on the derivative smoothed over 'width' (fast S1) or as a step above the
+  # mean of the previous 'rolling' samples (S2 rising over many samples).
+  # Regions without any edge are baseline fluctuations.
+  # Integrals, fprompt and the rms width come from prefix sums of the summed
+  # waveform, so every event of the batch is processed at once.
+  def get_pulses(self, wfs, width=2, s1_min=7, rolling=100, s1_window=62, s2_window=375, pre_gate=7,
+                 threshold=5, s1_fprompt=0.3, bl_gate=400, polarity=1):
+    width, rolling, pre_gate = max(int(round(width)), 1), int(round(rolling)), int(round(pre_gate))
+    s1_window, s2_window = int(round(s1_window)), int(round(s2_window))
+    if wfs.ndim == 2: wfs = wfs[np.newaxis]
+    summed  = polarity*np.sum(wfs, axis=1, dtype=np.float64)
+    summed -= np.mean(summed[:, :bl_gate], axis=1, keepdims=True)
+    nevs, samples = summed.shape
+
+    # prefix sums of x, t*x and t^2*x for integrals and moments over any window
+    t   = np.arange(samples)
+    cum = np.zeros((3, nevs, samples+1))
+    np.cumsum(summed, axis=1, out=cum[0, :, 1:])
+    np.cumsum(summed*t, axis=1, out=cum[1, :, 1:])
+    np.cumsum(summed*t*t, axis=1, out=cum[2, :, 1:])
+    window = lambda c, a, b: cum[c][:, np.minimum(b, samples)] - cum[c][:, np.minimum(a, samples)]
+
+    # pulse extension from the rolling integral; rising edges from the derivative smoothed
+    # over 'width' (fast) or from the step between the means of the next 'width' and the
+    # previous 'rolling' samples (slow), each against its rms in the baseline
+    roll   = window(0, t, t + rolling)
+    fast   = window(0, t, t + width) - window(0, np.maximum(t - width, 0), t)
+    slow   = window(0, t, t + width)/width - window(0, np.maximum(t - rolling, 0), t)/rolling
+    bl     = slice(rolling, bl_gate) if bl_gate >= 2*rolling else slice(0, bl_gate)  # full windows if possible
+    rising = ((fast > threshold*np.std(fast[:, :bl_gate], axis=1, keepdims=True)) |
+              (slow > threshold*np.std(slow[:, bl], axis=1, keepdims=True)))
+
+    pos = np.flatnonzero(roll > s1_min)
+    if len(pos) == 0: return np.zeros(0, dtype=PULSE_DTYPE)
+    new   = np.r_[True, (np.diff(pos) != 1) | (pos[1:] % samples == 0)]
+    first = np.flatnonzero(new)
+    last  = np.r_[first[1:], len(pos)] - 1
+    edge  = np.minimum.reduceat(np.where(rising.reshape(-1)[pos], pos, pos[-1] + 1), first)
+    found = edge <= pos[last]  # regions without a rising edge are baseline fluctuations
+    edge, first, last = edge[found], first[found], last[found]
+
+    ev    = pos[first] // samples
+    start = np.maximum(edge % samples - pre_gate, 0)
+    end   = pos[last] % samples + 1
+    get   = lambda c, a, b: cum[c, ev, np.minimum(b, samples)] - cum[c, ev, a]
+
+    integral = get(0, start, end)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      mean    = get(1, start, end)/integral
+      width   = np.sqrt(np.maximum(get(2, start, end)/integral - mean**2, 0))
+      fprompt = get(0, start, start + s1_window)/get(0, start, start + s2_window)
+
+    pulses = np.zeros(len(first), dtype=PULSE_DTYPE)
+    pulses['event'], pulses['start'], pulses['end'] = ev, start, end
+    pulses['integral'], pulses['width'], pulses['fprompt'] = integral, width, fprompt
+    pulses['type'] = np.where(fprompt > s1_fprompt, 1, 2)
+    return pulses[integral >= s1_min]
+
+
+  # Return the cluster table (see CLUSTER_DTYPE) of a hit table (see get_hits)
+  # Parameters (in samples, see the [scint_clustering] section):
+  #    hits is a hit table of any number of events
+  #    window is the minimum duration of a cluster
+  #    distance is the minimum gap between two clusters
+  #    threshold is the minimum charge (summed hit integrals, ADC x samples) of a
+  #      cluster inside sliding_window samples
+  #    precluster merges hits with peaks closer than this before clustering
+  #    s1window is the length always integrated after the first cluster of an event (S1)
+  #
+  # Hits are sorted once by (event, peak time); preclusters and clusters are then
+  # built by sweeping the sorted times with diff/cumsum/reduceat, so a batch costs
+  # O(n log n) whatever the number of hits per event.
+  def get_clusters(self, hits, window=1000, distance=500, threshold=5, sliding_window=500,
+                   precluster=20, s1window=4000):
+    if len(hits) == 0: return np.zeros(0, dtype=CLUSTER_DTYPE)
+    hits  = hits[np.lexsort((hits['peak'], hits['event']))]
+    ev    = hits['event'].astype(np.int64)
+    big   = np.int64(1) << 32  # event offset making (event, time) keys sortable as one integer
+    newev = np.r_[True, ev[1:] != ev[:-1]]
+
+    # preclusters: hits closer than 'precluster' to the previous one
+    pre   = np.flatnonzero(newev | (np.diff(hits['peak'], prepend=0) > precluster))
+    p_ev  = ev[pre]
+    p_t   = hits['peak'][pre].astype(np.int64)
+    p_beg = np.minimum.reduceat(hits['start'], pre).astype(np.int64)
+    p_end = np.maximum.reduceat(hits['stop'], pre).astype(np.int64)
+    p_q   = np.add.reduceat(hits['integral'], pre)
+    p_n   = np.diff(np.r_[pre, len(hits)])
+    p_new = newev[pre]
+
+    # clusters: gap to the furthest end so far in the event above 'distance',
+    # outside of the s1window following the first precluster of the event
+    t0   = p_beg[np.maximum.accumulate(np.where(p_new, np.arange(len(pre)), 0))]
+    last = np.maximum.accumulate(p_ev*big + p_end) - p_ev*big
+    new  = p_new | ((p_beg - np.r_[0, last[:-1]] > distance) & (p_beg >= t0 + s1window))
+    clu  = np.flatnonzero(new)
+
+    # largest charge in a sliding window starting at each precluster, within its cluster
+    key = p_ev*big + p_t
+    cq  = np.r_[0, np.cumsum(p_q)]
+    lim = np.r_[clu[1:], len(pre)][np.cumsum(new) - 1]
+    hi  = np.minimum(np.searchsorted(key, key + sliding_window), lim)
+    best = np.maximum.reduceat(cq[hi] - cq[:-1], clu)
+
+    start    = np.minimum.reduceat(p_beg, clu)
+    duration = np.maximum(np.maximum.reduceat(p_end, clu) - start, window)
+    duration = np.where(p_new[clu], np.maximum(duration, s1window), duration)
+
+    clusters = np.zeros(len(clu), dtype=CLUSTER_DTYPE)
+    clusters['event'], clusters['start'], clusters['duration'] = p_ev[clu], start, duration
+    clusters['charge'], clusters['nhits'] = np.add.reduceat(p_q, clu), np.add.reduceat(p_n, clu)
+    return clusters[best >= threshold]
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Startup-time benchmark for the reconstruction CLI and its worker processes.
+# With per-subrun batch jobs or process pools the import time is paid once
+# per job/worker, so it has to stay small.
+#
+# Usage:
+#   python bench_startup.py [-n 5] [--max-help 2.0] [--max-spawn 2.0]
+# Exit status is 1 if a median time exceeds its limit or if a plotting/DataFrame
+# module is imported by the reconstruction modules.
+
+from argparse import ArgumentParser
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+import time
+
+HERE  = os.path.dirname(os.path.abspath(__file__))
+HEAVY = ('matplotlib', 'pandas')
+
+
+# time of 'python liverpool_test.py --help' in a fresh interpreter
+def time_help():
+  t0 = time.perf_counter()
+  subprocess.run([sys.executable, 'liverpool_test.py', '--help'], cwd=HERE,
+                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+  return time.perf_counter() - t0
+
+
+# worker target: import the reconstruction modules and report the heavy ones loaded
+def _worker(q):
+  sys.path.insert(0, HERE)
+  import liverpool_test
+  q.put([m for m in HEAVY if m in sys.modules])
+
+
+# time to spawn a worker process ready to reconstruct
+def time_spawn():
+  ctx = mp.get_context('spawn')
+  q   = ctx.Queue()
+  t0  = time.perf_counter()
+  p   = ctx.Process(target=_worker, args=(q,))
+  p.start()
+  heavy = q.get()
+  dt = time.perf_counter() - t0
+  p.join()
+  return dt, heavy
+
+
+def main():
+  parser = ArgumentParser()
+  parser.add_argument('-n', '--repeat', type=int, default=5, help='number of repetitions')
+  parser.add_argument('--max-help', type=float, default=2.0, help='limit on the median --help time (s)')
+  parser.add_argument('--max-spawn', type=float, default=2.0, help='limit on the median worker spawn time (s)')
+  args = parser.parse_args()
+
+  helps  = sorted(time_help() for _ in range(args.repeat))
+  spawns = [time_spawn() for _ in range(args.repeat)]
+  heavy  = sorted(set(m for _, ms in spawns for m in ms))
+  spawns = sorted(dt for dt, _ in spawns)
+  t_help, t_spawn = helps[len(helps)//2], spawns[len(spawns)//2]
+
+  print(f'liverpool_test.py --help: median {t_help:1.3f}s  min {helps[0]:1.3f}s  max {helps[-1]:1.3f}s')
+  print(f'worker spawn:             median {t_spawn:1.3f}s  min {spawns[0]:1.3f}s  max {spawns[-1]:1.3f}s')
+
+  failed = False
+  if t_help > args.max_help:
+    print(f'FAIL: --help slower than {args.max_help}s')
+    failed = True
+  if t_spawn > args.max_spawn:
+    print(f'FAIL: worker spawn slower than {args.max_spawn}s')
+    failed = True
+  if heavy:
+    print(f'FAIL: heavy modules imported at startup: {", ".join(heavy)}')
+    failed = True
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+  main()
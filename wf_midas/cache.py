@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+# Content-addressed cache of reconstruction results, see the [cache] section.
+# Stage outputs of the Executor are stored per subrun in a local directory,
+# one .npz per (stage, key) with one array per batch. The key of a stage
+# (Executor.keys) hashes the input file identity, the config sections the
+# stage depends on and the keys of its inputs: on a rerun, unchanged stages
+# are loaded and only the stages downstream of a change run again. The
+# unpacked raw waveforms can be stored as stage 'raw' (uint16, the smallest
+# form of the waveforms): cheap stages such as the baseline subtraction are
+# then recomputed without reading and unpacking the subrun again. The
+# directory is kept below a size limit by removing the least recently used
+# entries.
+
+import hashlib
+import os
+import zipfile
+import numpy as np
+
+
+class ResultCache:
+  """Per-subrun stage outputs on a local directory with size-based LRU eviction.
+  Usage:
+    cache = ResultCache.from_config(config.pars)
+    for outs in cache.run(executor, cache.source(fname, batch_size), batches):
+      ...  # {sink: output} of each batch of the subrun
+  """
+
+  def __init__(self, directory='reco_cache', max_bytes=20 << 30, stages=(), hash_content=False):
+    """Constructor.
+    Args:
+      directory (str): cache directory, created on first store
+      max_bytes (int): size of the directory above which least recently used entries are removed
+      stages (list): stages whose outputs are stored, 'raw' for the unpacked waveforms
+      hash_content (bool): identify input files by the hash of their content instead of path, size and mtime
+    """
+    self.directory    = directory
+    self.max_bytes    = max_bytes
+    self.stages       = set(stages)
+    self.hash_content = hash_content
+
+  @classmethod
+  def from_config(cls, pars):
+    """Build the cache from the [cache] section of Config.pars."""
+    c = pars.cache
+    return cls(c.directory, int(c.max_gb*(1 << 30)), [str(s) for s in c.stages], c.hash_content)
+
+  def source(self, fname, *extra):
+    """Return the identity of an input file (and of 'extra' values changing the batches, e.g. their size)."""
+    st = os.stat(fname)
+    if self.hash_content:
+      h = hashlib.sha1()
+      with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''): h.update(block)
+      ident = (st.st_size, h.hexdigest())
+    else:
+      ident = (os.path.abspath(fname), st.st_size, st.st_mtime_ns)
+    return hashlib.sha1(repr((ident, extra)).encode()).hexdigest()[:16]
+
+  def path(self, stage, key):
+    return os.path.join(self.directory, f'{stage}-{key}.npz')
+
+  def open(self, stage, key):
+    """Return the NpzFile of an entry (arrays b0, b1, ... per batch) marked as recently used, None if not cached."""
+    fname = self.path(stage, key)
+    try:
+      entry = np.load(fname)
+      os.utime(fname)
+    except FileNotFoundError:  # not cached, or evicted by another process
+      return None
+    return entry
+
+  def evict(self):
+    """Remove least recently used entries until the directory holds at most max_bytes."""
+    entries = []
+    for e in os.scandir(self.directory):
+      if e.name.endswith('.npz'):
+        st = e.stat()
+        entries.append((st.st_mtime, st.st_size, e.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if total <= self.max_bytes: break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      total -= size
+
+  def run(self, executor, source, batches):
+    """Yield {sink: output} for every batch of a subrun, from the cache where possible.
+    Stored stages are loaded, the others run from their closest stored inputs and are
+    stored batch by batch (the entries appear when the subrun is complete). An entry
+    growing beyond max_bytes is dropped with a warning rather than written and then
+    evicted. The subrun is read only if some stage needs the raw waveforms and they
+    are not stored.
+    Args:
+      executor (Executor): stages and sinks
+      source (str): identity of the subrun, see source()
+      batches (callable): returns an iterable over the raw batches (event, channel, sample) of the subrun
+    """
+    keys    = executor.keys(source)
+    entries = {}   # stage -> NpzFile
+    todo    = set()
+
+    def need(name):
+      if name in entries or name in todo: return
+      entry = self.open(name, keys[name]) if name in self.stages else None
+      if entry is not None:
+        entries[name] = entry
+        return
+      todo.add(name)
+      for i in executor.inputs.get(name, ()): need(i)
+    for s in executor.sinks: need(s)
+
+    writers  = {}
+    complete = False
+    try:
+      if todo & self.stages: os.makedirs(self.directory, exist_ok=True)
+      for name in todo & self.stages:
+        tmp = f'{self.path(name, keys[name])}.{os.getpid()}.tmp'
+        writers[name] = (tmp, zipfile.ZipFile(tmp, 'w'))
+
+      if 'raw' in todo:
+        items = batches()
+      else:
+        items = range(len(next(iter(entries.values())).files))
+      for i, item in enumerate(items):
+        data = {name: entry[f'b{i}'] for name, entry in entries.items()}
+        if 'raw' in todo: data['raw'] = np.asarray(item)
+        executor.execute(data, todo)
+        for name, (tmp, zf) in list(writers.items()):
+          with zf.open(f'b{i}.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asanyarray(data[name]), allow_pickle=False)
+          if zf.fp.tell() > self.max_bytes:  # would be evicted as soon as written
+            print(f"Warning: cache entry of stage '{name}' larger than {self.max_bytes} bytes, not stored")
+            zf.close()
+            os.remove(tmp)
+            del writers[name]
+        yield {s: data[s].copy() if data[s] is executor.buffers.get(s) else data[s] for s in executor.sinks}
+      complete = True
+    finally:
+      for entry in entries.values(): entry.close()
+      for name, (tmp, zf) in writers.items():
+        zf.close()
+        if complete:
+          os.replace(tmp, self.path(name, keys[name]))
+        else:
+          os.remove(tmp)
+      if complete and writers:
+        self.evict()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Single photoelectron (SER) calibration, see [base] ser and db_filename.
+# SERCalibration fills per-channel charge spectra of low-light/laser runs
+# batch by batch and fits the pe peaks at the end of the run.
+# CalibrationDB stores the gains in a local JSON file indexed by run number
+# and answers "closest calibration run preceding a run" with a bisect on
+# an index loaded once per process.
+
+from bisect import bisect_right
+import json
+import os
+import numpy as np
+from scipy.signal import find_peaks
+
+
+class SERCalibration:
+  """Per-channel single-pe charge spectra with fixed bins.
+  Usage:
+    cal = SERCalibration(nchannels=64, qmin=-50, qmax=450, nbins=500)
+    for ...:
+      cal.fill(charges)  # (event, channel) charges, e.g. from get_roi or get_integrals
+    gains = cal.fit()
+  """
+
+  def __init__(self, nchannels, qmin=-50, qmax=450, nbins=500):
+    self.nchannels = nchannels
+    self.edges     = np.linspace(qmin, qmax, nbins + 1)
+    self.centers   = 0.5*(self.edges[1:] + self.edges[:-1])
+    self.qmin, self.width, self.nbins = qmin, (qmax - qmin)/nbins, nbins
+    self.hist      = np.zeros((nchannels, nbins), dtype=np.int64)
+
+  def fill(self, q, channels=None):
+    """Add charges to the spectra with one bincount.
+    Args:
+      q (array): (event, channel) charges, or 1d charges of the given channels (e.g. hits['integral'])
+      channels (array, None): channel of each charge for 1d q
+    """
+    q = np.asarray(q, dtype=np.float64)
+    if channels is None:
+      channels = np.broadcast_to(np.arange(q.shape[-1]), q.shape)
+    b  = np.floor((q - self.qmin)/self.width).astype(np.int64)
+    ok = (b >= 0) & (b < self.nbins)
+    self.hist += np.bincount((np.asarray(channels)*self.nbins + b)[ok],
+                             minlength=self.nchannels*self.nbins).reshape(self.nchannels, self.nbins)
+
+  def merge(self, other):
+    """Add the spectra of another SERCalibration (e.g. from a worker process)."""
+    self.hist += other.hist
+    return self
+
+  def fit(self, smooth=3, prominence=0.05):
+    """Fit the pe peaks of every channel.
+    Peaks are found on the smoothed spectrum and refined with the charge-weighted
+    mean within half a peak spacing; the gain is the median spacing between
+    consecutive peaks (pedestal, 1 pe, 2 pe, ...).
+    Return a dict of per-channel arrays: gain, pedestal, sigma (1 pe peak), npeaks, entries.
+    NaN for channels with fewer than two peaks.
+    """
+    kernel = np.ones(smooth)/smooth
+    out = {k: np.full(self.nchannels, np.nan) for k in ('gain', 'pedestal', 'sigma')}
+    out['npeaks']  = np.zeros(self.nchannels, dtype=int)
+    out['entries'] = self.hist.sum(axis=1)
+    for ch, h in enumerate(self.hist):  # once per run, not per event
+      hs = np.convolve(h, kernel, mode='same')
+      if hs.max() <= 0: continue
+      peaks, _ = find_peaks(hs, prominence=prominence*hs.max())
+      out['npeaks'][ch] = len(peaks)
+      if len(peaks) < 2: continue
+      half = max(int(np.median(np.diff(peaks)))//2, 1)
+      pos, sig = [], []
+      for p in peaks:
+        sl = slice(max(p - half, 0), p + half + 1)
+        w, c = h[sl], self.centers[sl]
+        m = np.sum(w*c)/max(w.sum(), 1)
+        pos.append(m)
+        sig.append(np.sqrt(max(np.sum(w*(c - m)**2)/max(w.sum(), 1), 0)))
+      out['gain'][ch]     = np.median(np.diff(pos))
+      out['pedestal'][ch] = pos[0]
+      out['sigma'][ch]    = sig[1]
+    return out
+
+
+class CalibrationDB:
+  """Local calibration file: {run number: {'gain': [...], ...}} in JSON.
+  Instances are cached per process and per file modification time (see open()),
+  so lookups never read the disk per event.
+  Usage:
+    db = CalibrationDB.open(config('base', 'db_filename'))
+    gains = db.lookup(run, ser=config('base', 'ser', 'int'))['gain']
+  """
+
+  __cache = {}
+
+  def __init__(self, fname):
+    self.fname = fname
+    self.data  = {}
+    if os.path.isfile(fname):
+      with open(fname) as f:
+        self.data = {int(run): {k: np.asarray(v) for k, v in cal.items()} for run, cal in json.load(f).items()}
+    self.runs  = sorted(self.data)
+
+  @classmethod
+  def open(cls, fname):
+    """Return the CalibrationDB of fname, read from disk only if new or modified."""
+    key = (os.path.abspath(fname), os.path.getmtime(fname) if os.path.isfile(fname) else None)
+    if key not in cls.__cache:
+      cls.__cache[key] = cls(fname)
+    return cls.__cache[key]
+
+  def nearest(self, run):
+    """Return the closest calibration run preceding (or equal to) run, None if there is none."""
+    i = bisect_right(self.runs, run)
+    return self.runs[i-1] if i else None
+
+  def lookup(self, run, ser=0):
+    """Return the calibration to use for run: run 'ser' if ser > 0, else the nearest preceding one."""
+    key = ser if ser > 0 else self.nearest(run)
+    if key not in self.data:
+      raise KeyError(f"No calibration for run {run} (ser = {ser}) in {self.fname}.")
+    return self.data[key]
+
+  def store(self, run, cal):
+    """Add or replace the calibration of a run and rewrite the file atomically."""
+    self.data[int(run)] = {k: np.asarray(v) for k, v in cal.items()}
+    self.runs = sorted(self.data)
+    tmp = f'{self.fname}.tmp'
+    with open(tmp, 'w') as f:
+      json.dump({str(r): {k: np.asarray(v).tolist() for k, v in c.items()} for r, c in self.data.items()}, f)
+    os.replace(tmp, self.fname)
+    print(f'Calibration of run {run} stored in {self.fname}')
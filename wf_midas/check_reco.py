@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# Regression checks of the reconstruction stages on synthetic events.
+# Events are made of a flat baseline with gaussian noise and one pulse per
+# channel, negative as read from the MIDAS files ([pdm_reco] polarity = 0)
+# or positive (polarity = 1); the stages must find the same positive charge.
+#
+# Usage:
+#   python check_reco.py
+# Exit status is 1 if a check fails.
+
+import sys
+import numpy as np
+from config import Config
+from executor import Executor
+
+
+# batch of raw uint16 events (event, channel, sample) with one pulse of 'amplitude' ADC
+# counts (sign included) per channel starting at sample 'start'
+def synthetic_events(nevs=4, nchs=8, samples=4000, start=2000, amplitude=-200, baseline=8000, seed=0):
+  rng   = np.random.default_rng(seed)
+  t     = np.arange(samples) - start
+  pulse = np.where(t >= 0, np.exp(-np.clip(t, 0, None)/100), 0)
+  wfs   = baseline + rng.normal(0, 3, (nevs, nchs, samples)) + amplitude*pulse
+  return np.round(wfs).astype(np.uint16)
+
+
+def check(polarity, amplitude):
+  config = Config(cmdline_args=f'-p pdm_reco:polarity:{polarity}', is_req_input=False)
+  ex     = Executor(config.pars, sinks=['hits', 'pulses', 'roi'],
+                    windows={'bl_from': 0, 'bl_to': 1500, 'roi_low': 1900, 'roi_tot': 1000})
+  outs   = ex(synthetic_events(amplitude=amplitude))
+  hits, pulses, roi = outs['hits'], outs['pulses'], outs['roi']
+  errors = []
+  if len(hits) == 0 or (hits['integral'] <= 0).any():
+    errors.append(f'{len(hits)} hits, integrals {hits["integral"][:4]}')
+  if len(pulses) == 0 or ((pulses['fprompt'] < 0) | (pulses['fprompt'] > 1)).any():
+    errors.append(f'{len(pulses)} pulses, fprompt {pulses["fprompt"][:4]}')
+  if (roi <= 0).any():
+    errors.append(f'roi totals {roi.ravel()[:4]}')
+  print(f'polarity {polarity}, pulse of {amplitude} ADC: {len(hits)} hits, {len(pulses)} pulses, '
+        f'mean roi {roi.mean():.0f}' + ''.join(f'\n  FAIL: {e}' for e in errors))
+  return not errors
+
+
+def main():
+  ok = all([check(0, -200), check(1, 200)])
+  sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,13 +1,76 @@
 from argparse import ArgumentParser
 from configparser import ConfigParser
+import ast
 import copy
+import hashlib
 import io
 import numpy as np
 import os
 import pkgutil
 import shlex
 import sys
-from matplotlib.backends.backend_pdf import PdfPages
+
+
+# Parameters given in seconds (s) or nanoseconds (ns) in the .ini files.
+# They are converted to samples with [daq] sampling in the snapshot (Config.pars).
+TIME_UNITS = {
+  'daq':           {'jitter': 1, 'gate': 1, 'pre': 1},
+  'sipm':          {'ap-tau': 1},
+  'arma':          {'tau': 1, 'sigma': 1},
+  'reco':          {'baseline_from': 1, 'baseline_to': 1, 'fprompt_from': 1, 'fprompt_to': 1},
+  'pulse_finding': {'width': 1e-9, 'rolling': 1e-9, 's1_window': 1e-9, 's2_window': 1e-9, 'pre_gate': 1e-9},
+  'pdm_reco':      {'baseline_to': 1, 'running_gate': 1, 'min_time_between_peaks': 1,
+                    'extended_time_for_integral': 1, 'roi_left': 1, 'roi_right': 1},
+}
+
+
+class Parameters:
+  """Immutable set of typed parameters, accessed as attributes or items.
+  Used both for the whole snapshot (sections as attributes) and for each section.
+  Keys containing '-' are also available with '_' (e.g. sipm.ap_tau).
+  """
+  __slots__ = ('_name', '_pars')
+
+  def __init__(self, name, pars):
+    object.__setattr__(self, '_name', name)
+    object.__setattr__(self, '_pars', dict(pars))
+    for key in list(self._pars):
+      self._pars.setdefault(key.replace('-', '_'), self._pars[key])
+    for val in self._pars.values():
+      if isinstance(val, np.ndarray): val.flags.writeable = False
+
+  def __getattr__(self, key):
+    try:
+      return object.__getattribute__(self, '_pars')[key]
+    except KeyError:
+      raise AttributeError(f"'{self._name}' has no parameter '{key}'") from None
+
+  def __getitem__(self, key):
+    return self._pars[key]
+
+  def __setattr__(self, key, val):
+    raise AttributeError(f"'{self._name}' parameters are read-only")
+
+  def __contains__(self, key):
+    return key in self._pars
+
+  def __iter__(self):
+    return iter(self._pars)
+
+  def __getstate__(self):
+    return self._name, self._pars
+
+  def __setstate__(self, state):
+    Parameters.__init__(self, *state)
+
+  def __repr__(self):
+    return f"<Parameters {self._name}: {self._pars}>"
+
+  def get(self, key, default=None):
+    return self._pars.get(key, default)
+
+  def items(self):
+    return self._pars.items()
 
 
 class Config:
@@ -90,12 +153,11 @@ class Config:
     if 'seed' in self('base'):
       np.random.seed(self('base', 'seed', 'int'))
 
-    # Write configuration to PDF
-    self.pdf = None
-    if args['view']:
-      self.pdf = PdfPages(f'{self.output}.pdf')
-      d = self.pdf.infodict()
-      d['Title'] = 'test pdf writer'
+    # Name of the PDF written by the event display (see display.py)
+    self.pdf = f'{self.output}.pdf' if args['view'] else None
+
+    # Typed parameters for hot code and worker processes
+    self.pars = self.snapshot()
 
   def __call__(self, section=None, key=None, dtype='str'):
     """Used to return configuration dictionary sections or values and prevent modification."""
@@ -120,6 +182,33 @@ class Config:
     """Output when printing an instance of this class."""
     return f"<Config: {str(self.__config._sections)}>"
 
+  def snapshot(self):
+    """Compile the configuration into immutable typed parameters.
+    Values are cast once (bool, int, float, None, lists as numpy arrays, str otherwise)
+    and the times listed in TIME_UNITS are converted to samples.
+    The result is cheap to pickle to worker processes.
+    Usage:
+      pars = config.snapshot()
+      pars.pdm_reco.running_gate  # samples
+      pars.mapping.full_map       # numpy array
+    """
+    sections = {sect: {key: self.__cast(val) for key, val in self.__config.items(sect)}
+                for sect in self.__config.sections()}
+    sampling = sections['daq']['sampling']
+    for sect, units in TIME_UNITS.items():
+      for key, unit in units.items():
+        if key in sections.get(sect, {}):
+          sections[sect][key] = self.__to_samples(sections[sect][key], unit, sampling)
+    return Parameters('config', {sect: Parameters(sect, pars) for sect, pars in sections.items()})
+
+  def hash(self, *sections):
+    """Return a short hash of the given sections (all if none), used to key cached results.
+    Only the raw strings are hashed, so any change of a value in those sections changes the hash.
+    """
+    sections = sorted(sections or self.__config.sections())
+    items = [(sect, sorted(self.__config.items(sect))) for sect in sections if self.__config.has_section(sect)]
+    return hashlib.sha1(repr(items).encode()).hexdigest()[:16]
+
   def update(self, source, **kwargs):
     """Update configuration parameters with a file name or dictionary.
     Args:
@@ -131,6 +220,8 @@ class Config:
     for sect in c.sections():  # Update values in configuration dictionary
       for key, val in c.items(sect):
         self.__config.set(sect, key, val)
+    if hasattr(self, 'pars'):  # Keep the snapshot in sync after startup
+      self.pars = self.snapshot()
 
   @staticmethod
   def __parse_config(source, check_wd=True):
@@ -157,6 +248,28 @@ class Config:
       raise TypeError(f"Source type '{type(source)}' not implemented.")
     return parser
 
+  @staticmethod
+  def __cast(val):
+    """Cast a configuration string to bool, None, int, float, numpy array or str."""
+    if val.lower() in ('true', 'false'):
+      return val.lower() == 'true'
+    if val == 'None':
+      return None
+    for cast in (int, float):
+      try:
+        return cast(val)
+      except ValueError:
+        pass
+    if val[:1] in ('[', '('):
+      return np.array(ast.literal_eval(val))
+    return val
+
+  @staticmethod
+  def __to_samples(val, unit, sampling):
+    """Convert a time in units of 'unit' seconds to samples, as int when it is a whole number."""
+    samples = val*unit*sampling
+    return int(round(samples)) if abs(samples - round(samples)) < 1e-6 else samples
+
   @staticmethod
   def __parse_skv(skv):
     """Parse section, key, and value from s:k:v command line input."""
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Event display for sets of waveforms, matrix defined as (channel, sample).
+# Traces are reduced to per-pixel min/max envelopes before plotting, and
+# PDF pages are rendered in a separate process fed through a bounded queue,
+# so that the reconstruction loop only pays for the decimation (and waits
+# only when the writer is 'maxsize' pages behind). The number of events
+# drawn is limited, see [view] nbmax_wf.
+
+import multiprocessing as mp
+import queue
+import numpy as np
+
+
+# Reduce waveforms to per-pixel min/max envelopes
+# Parameters:
+#    wfs is a 1d (samples) or 2d (channel, sample) array
+#    npix is the number of horizontal pixels (bins) of the envelope
+#
+# Each bin of ceil(samples/npix) samples is replaced by its min and max,
+# interleaved so that the line drawn through them covers the full excursion.
+# Return x (in samples) and the decimated waveforms, with 2*npix points.
+def minmax_decimate(wfs, npix=1000):
+  wfs = np.atleast_2d(wfs)
+  nchs, samples = wfs.shape
+  if samples <= 2*npix:
+    return np.arange(samples), wfs
+
+  block = -(-samples // npix)
+  npix  = -(-samples // block)
+  pad   = npix*block - samples
+  if pad: wfs = np.pad(wfs, ((0, 0), (0, pad)), mode='edge')
+
+  blocks = wfs.reshape(nchs, npix, block)
+  env    = np.empty((nchs, npix, 2), dtype=wfs.dtype)
+  env[:,:,0] = blocks.min(axis=2)
+  env[:,:,1] = blocks.max(axis=2)
+  x = np.repeat(np.arange(npix)*block, 2) + np.tile([0, block-1], npix)
+  return np.minimum(x, samples-1), env.reshape(nchs, 2*npix)
+
+
+# Draw one page of decimated waveforms on a matplotlib figure
+# Parameters:
+#    fig is a matplotlib Figure
+#    x is the time axis in us, ys the (channel, point) envelopes
+#    chs the channel numbers of the rows of ys
+#    overlay draws all channels on one axes with a single LineCollection
+def draw_page(fig, x, ys, chs, title='', ncols=2, overlay=False):
+  if overlay:
+    from matplotlib.collections import LineCollection
+    ax = fig.add_subplot(1, 1, 1)
+    segs = np.empty((len(ys), len(x), 2))
+    segs[:,:,0] = x
+    segs[:,:,1] = ys
+    ax.add_collection(LineCollection(segs, linewidths=0.5, colors='k'))
+    ax.autoscale_view()
+    ax.set_title(f'{title} Ch {chs[0]}-{chs[-1]}')
+    ax.set_xlabel('Time (us)')
+    ax.set_ylabel('Voltage (ADC)')
+    return fig
+
+  nrows = -(-len(ys) // ncols)
+  axs   = fig.subplots(nrows, ncols, squeeze=False)
+  for i, ax in enumerate(axs.flat):
+    if i >= len(ys):
+      ax.set_axis_off()
+      continue
+    ax.plot(x, ys[i], linewidth=0.5, color='k')
+    ax.set_title(f'{title} Ch {chs[i]}')
+    ax.set_xlabel('Time (us)')
+    ax.set_ylabel('Voltage (ADC)')
+  fig.tight_layout()
+  return fig
+
+
+# Writer process: render the pages received on the queue into a PDF.
+# Figures are built without pyplot so no GUI backend is touched.
+def _pdf_writer(pages, fname, title):
+  from matplotlib.figure import Figure
+  from matplotlib.backends.backend_pdf import PdfPages
+
+  with PdfPages(fname) as pdf:
+    pdf.infodict()['Title'] = title
+    while True:
+      page = pages.get()
+      if page is None: break
+      x, ys, chs, label, ncols, overlay, figsize = page
+      fig = Figure(figsize=figsize)
+      pdf.savefig(draw_page(fig, x, ys, chs, label, ncols, overlay))
+
+
+class EventDisplay:
+  """Event display writing decimated waveforms to a PDF from a background process.
+  Usage:
+    display = EventDisplay('run.pdf', sampling=125e6, max_events=config.pars.view.nbmax_wf)
+    for nev, event in enumerate(events):
+      display.draw(wfs, label=f'Ev {nev}')  # no-op after max_events events
+    display.close()
+  """
+
+  def __init__(self, fname, sampling=125e6, npix=1000, chs_per_page=4, ncols=2,
+               overlay=False, figsize=(12, 8), maxsize=64, max_events=None, title='test pdf writer'):
+    """Constructor.
+    Args:
+      fname (str): output PDF file name
+      sampling (float): sampling rate in S/s, used for the time axis in us
+      npix (int): number of min/max bins per trace
+      chs_per_page (int): channels per page, ignored if overlay is True
+      ncols (int): columns of the subplot grid
+      overlay (bool): draw all channels of an event on a single axes
+      figsize (tuple): figure size in inches
+      maxsize (int): maximum number of pages waiting in the queue, draw() blocks when it is full
+                     (RuntimeError if the writer dies meanwhile)
+      max_events (int, None): number of events drawn, None for all
+      title (str): PDF title
+    """
+    self.us_per_sample = 1e6/sampling
+    self.npix          = npix
+    self.chs_per_page  = chs_per_page
+    self.ncols         = ncols
+    self.overlay       = overlay
+    self.figsize       = figsize
+    self.max_events    = max_events
+    self.nevents       = 0
+    self.pages         = mp.Queue(maxsize=maxsize)
+    self.writer        = mp.Process(target=_pdf_writer, args=(self.pages, fname, title), daemon=True)
+    self.writer.start()
+    print(f'Event display: writing {fname}')
+
+  def draw(self, wfs, label='', chs=None):
+    """Decimate the waveforms of an event and queue them for rendering.
+    Every page is written: the call waits while the writer is maxsize pages behind.
+    Return False, without drawing, once max_events events were drawn.
+    Args:
+      wfs (array): 1d or 2d (channel, sample) waveforms
+      label (str): prefix of the subplot titles
+      chs (array, None): channel numbers of the rows of wfs
+    """
+    if self.max_events is not None and self.nevents >= self.max_events:
+      return False
+    self.nevents += 1
+    x, ys = minmax_decimate(wfs, self.npix)
+    x     = x*self.us_per_sample
+    chs   = np.arange(len(ys)) if chs is None else np.asarray(chs)
+    step  = len(ys) if self.overlay else self.chs_per_page
+    for i in range(0, len(ys), step):
+      page = (x, ys[i:i+step], chs[i:i+step], label, self.ncols, self.overlay, self.figsize)
+      self.__put(page)
+    return True
+
+  # queue a page, waiting for the writer as long as it is alive
+  def __put(self, page, timeout=1):
+    while True:
+      if not self.writer.is_alive():
+        self.pages.cancel_join_thread()  # pages left in the queue must not block the exit
+        raise RuntimeError(f'Event display: the PDF writer died (exit code {self.writer.exitcode})')
+      try:
+        self.pages.put(page, timeout=timeout)
+        return
+      except queue.Full:
+        pass
+
+  def close(self):
+    """Flush the queue and wait for the writer to finish the PDF."""
+    self.__put(None)
+    self.writer.join()
+    if self.writer.exitcode:
+      raise RuntimeError(f'Event display: the PDF writer failed (exit code {self.writer.exitcode})')
+    print(f'Event display: {self.nevents} events written')
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
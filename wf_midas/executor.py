@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+# Config-driven reconstruction stages, see the [executor] section.
+# The dependency graph between stages is fixed below (STAGES); the .ini
+# file chooses the sinks, i.e. the outputs wanted per batch, and the
+# parameters of every stage come from their usual sections. Only the
+# stages needed by the sinks run, in dependency order. Intermediate
+# arrays are written into buffers allocated once per batch shape. The
+# modules of optional stages are imported only when they are scheduled,
+# to keep the startup of the main scripts short.
+
+import hashlib
+import numpy as np
+from scipy.ndimage import uniform_filter1d
+from algos import Algos, PrefixSums
+
+# stage -> input stages ('waveform' is the stage chosen by [executor] waveform)
+STAGES = {
+  'saturation': ('raw',),                # SAT_DTYPE flags, [sipm]
+  'baseline':   ('raw',),                # mean over [reco] bl_from, bl_to
+  'rms':        ('raw',),                # std over the same samples
+  'subtracted': ('raw', 'baseline'),    # pulses made positive, [pdm_reco] polarity
+  'filtered':   ('subtracted',),         # [executor] filter
+  'hits':       ('waveform', 'rms'),     # HIT_DTYPE table, [hit_finding]
+  'clusters':   ('hits',),               # CLUSTER_DTYPE table, [scint_clustering]
+  'pulses':     ('subtracted',),         # PULSE_DTYPE table, [pulse_finding]
+  'roi':        ('subtracted',),         # (event, channel) sums over [roi] roi_low, roi_tot
+  'xy':         ('roi',),                # XY_DTYPE table, [xyreco] and [mapping]
+  'silicon':    ('raw',),                # SILICON_DTYPE table, [silicon]
+}
+
+# stage -> sections of Config.pars it depends on, to key cached results (see cache.py);
+# the windows and the filter choice are added by Executor.keys
+SECTIONS = {
+  'saturation': ('sipm', 'daq'),
+  'baseline':   (),
+  'rms':        (),
+  'subtracted': (),
+  'filtered':   ('pdm_reco', 'arma'),
+  'hits':       ('hit_finding',),
+  'clusters':   ('scint_clustering',),
+  'pulses':     ('pulse_finding',),
+  'roi':        (),
+  'xy':         ('xyreco', 'mapping'),
+  'silicon':    ('silicon',),
+}
+
+
+class Executor:
+  """Run the stages needed by the sinks on batches of raw waveforms.
+  Sinks are returned as new arrays; intermediate buffers are reused by the next
+  call with the same batch shape, so outputs never alias them.
+  Usage:
+    ex   = Executor(config.pars)             # sinks from [executor] sinks
+    outs = ex(raw)                           # {sink: output}, raw (event, channel, sample) or (channel, sample)
+    ex   = Executor(config.pars, sinks=['hits'], windows=get_roi_windows(...))
+  """
+
+  def __init__(self, pars, sinks=None, windows=None):
+    """Constructor.
+    Args:
+      pars (Parameters): Config.pars snapshot
+      sinks (list, None): outputs to return, None for [executor] sinks
+      windows (dict, None): bl_from, bl_to, roi_low, roi_tot overriding [reco] and [roi] (e.g. from roi.py)
+    """
+    ex = pars.executor
+    self.pars    = pars
+    self.algos   = Algos()
+    self.windows = {'bl_from': pars.reco.bl_from, 'bl_to': pars.reco.bl_to,
+                    'roi_low': pars.roi.roi_low, 'roi_tot': pars.roi.roi_tot}
+    self.windows.update({k: v for k, v in (windows or {}).items() if k in self.windows})
+    # 0: negative pulses for MIDAS files, positive for root files
+    self.polarity = pars.pdm_reco.polarity or (1 if pars.pdm_reco.file_type == 'rootfile' else -1)
+    self.inputs  = {name: tuple(ex.waveform if i == 'waveform' else i for i in inputs)
+                    for name, inputs in STAGES.items()}
+    self.sinks   = [str(s) for s in (ex.sinks if sinks is None else sinks)]
+    self.order   = self.schedule(self.sinks)
+    self.buffers = {}
+    self.run     = {name: getattr(self, f'_Executor__{name}') for name in STAGES}
+    w = self.windows
+    self.options = {'baseline': (w['bl_from'], w['bl_to']), 'rms': (w['bl_from'], w['bl_to']),
+                    'subtracted': self.polarity, 'pulses': w['bl_to'],
+                    'roi': (w['roi_low'], w['roi_tot']), 'filtered': ex.filter}
+
+    # components of the scheduled stages, built once
+    if 'filtered' in self.order:
+      if ex.filter == 'running_mean':
+        self.filter = None
+      elif ex.filter == 'matched':
+        from filters import MatchedFilter
+        self.filter = MatchedFilter.from_config(pars)
+      elif ex.filter == 'deconvolution':
+        from filters import TailDeconvolution
+        self.filter = TailDeconvolution.from_config(pars)
+      else:
+        raise ValueError(f"Filter '{ex.filter}' not implemented.")
+    if 'xy' in self.order:
+      from mapping import ChannelMap
+      from xyreco import XYReco
+      x = pars.xyreco
+      self.xyreco = XYReco(x.m_pdms, x.n_pdms, x.eps, x.min_frac, x.is_max_chan, mapping=ChannelMap.from_config(pars))
+    if 'silicon' in self.order:
+      from silicon import SiliconReco
+      self.silicon = SiliconReco.from_config(pars)
+    self.saturation = None
+
+  def schedule(self, sinks):
+    """Return the stages needed by the sinks, each one after its inputs."""
+    order = []
+    def visit(name, path=()):
+      if name == 'raw' or name in order: return
+      if name not in self.inputs:
+        raise ValueError(f"Unknown stage '{name}', available: {', '.join(STAGES)}")
+      if name in path:
+        raise ValueError(f"Stage '{name}' depends on itself: {' -> '.join(path + (name,))}")
+      for i in self.inputs[name]: visit(i, path + (name,))
+      order.append(name)
+    for s in sinks: visit(s)
+    return order
+
+  # buffer of a stage, reallocated only when the batch shape changes
+  def buffer(self, name, shape, dtype=np.float64):
+    buf = self.buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+      buf = self.buffers[name] = np.empty(shape, dtype=dtype)
+    return buf
+
+  def keys(self, source):
+    """Return {stage: key} of the scheduled stages for the input identified by 'source'.
+    A key hashes the stage, its sections and options and the keys of its inputs, so a
+    change in one section only changes the keys of the stages depending on it and downstream.
+    """
+    keys = {'raw': str(source)}
+    for name in self.order:
+      pars  = [(sect, sorted((k, v.tolist() if isinstance(v, np.ndarray) else v)
+                             for k, v in self.pars[sect].items())) for sect in SECTIONS[name]]
+      parts = (name, pars, self.options.get(name), [keys[i] for i in self.inputs[name]])
+      keys[name] = hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+    return keys
+
+  def execute(self, data, stages):
+    """Run the given stages, in schedule order, on data {stage: output} holding their other inputs.
+    Outputs written in buffers are left there: copy those kept beyond the next call.
+    """
+    for name in self.order:
+      if name in stages:
+        data[name] = self.run[name](*(data[i] for i in self.inputs[name]))
+    return data
+
+  def __call__(self, raw):
+    """Return {sink: output} for a batch (event, channel, sample) or one event (channel, sample).
+    For one event the event axis is dropped from array outputs, tables keep their 'event' column.
+    """
+    raw    = np.asarray(raw)
+    single = raw.ndim == 2
+    data   = self.execute({'raw': raw[np.newaxis] if single else raw}, self.order)
+
+    outs = {}
+    for name in self.sinks:
+      out = data[name]
+      if out is self.buffers.get(name): out = out.copy()
+      if single and 'event' not in (out.dtype.names or ()): out = out[0]
+      outs[name] = out
+    return outs
+
+  # stages: one method per entry of STAGES, taking the outputs of its inputs
+
+  def __saturation(self, raw):
+    if self.saturation is None or len(self.saturation.thresholds) != raw.shape[1]:
+      from saturation import Saturation
+      self.saturation = Saturation.from_config(self.pars, raw.shape[1])
+    return self.saturation(raw)
+
+  def __baseline(self, raw):
+    w = self.windows
+    return np.mean(raw[..., w['bl_from']:w['bl_to']], axis=-1, keepdims=True,
+                   out=self.buffer('baseline', raw.shape[:-1] + (1,)))
+
+  def __rms(self, raw):
+    w = self.windows
+    return np.std(raw[..., w['bl_from']:w['bl_to']], axis=-1, keepdims=True,
+                  out=self.buffer('rms', raw.shape[:-1] + (1,)))
+
+  def __subtracted(self, raw, baseline):
+    out = self.buffer('subtracted', raw.shape)
+    return np.subtract(baseline, raw, out=out) if self.polarity < 0 else np.subtract(raw, baseline, out=out)
+
+  def __filtered(self, wfs):
+    if self.filter is None:
+      return uniform_filter1d(wfs, size=int(self.pars.pdm_reco.running_gate), axis=-1,
+                              output=self.buffer('filtered', wfs.shape))
+    return self.filter(wfs)  # the FFT and IIR filters allocate their output (no out= in scipy.fft/lfilter)
+
+  def __hits(self, wfs, rms):
+    h      = self.pars.hit_finding
+    smooth = self.buffer('hits.smooth', wfs.shape, np.float32)
+    prefix = PrefixSums(wfs, out=self.buffer('hits.prefix', wfs.shape[:-1] + (wfs.shape[-1] + 1,),
+                                             np.int64 if np.issubdtype(wfs.dtype, np.integer) else np.float64))
+    return self.algos.get_hits(wfs, rms, h.ma_gate, h.threshold, h.min_integral, h.window, smooth, prefix)
+
+  def __clusters(self, hits):
+    c = self.pars.scint_clustering
+    return self.algos.get_clusters(hits, c.window, c.distance, c.threshold, c.sliding_window,
+                                   c.precluster, c.s1window)
+
+  def __pulses(self, wfs):
+    p = self.pars.pulse_finding
+    return self.algos.get_pulses(wfs, p.width, p.s1_min, p.rolling, p.s1_window, p.s2_window, p.pre_gate,
+                                 p.threshold, p.s1_fprompt, bl_gate=self.windows['bl_to'])
+
+  def __roi(self, wfs):
+    lo = self.windows['roi_low']
+    return np.sum(wfs[..., lo:lo + self.windows['roi_tot']], axis=-1, out=self.buffer('roi', wfs.shape[:-1]))
+
+  def __xy(self, roi):
+    return self.xyreco.reco(roi)
+
+  def __silicon(self, raw):
+    return self.silicon(raw)
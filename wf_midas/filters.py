@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# Filters acting on whole batches of waveforms, matrix defined as
+# (event, channel, sample) or (channel, sample), along the last axis.
+
+import numpy as np
+from scipy import fft
+from scipy.ndimage import gaussian_filter1d
+from scipy.signal import lfilter
+
+
+# Single photoelectron response of the SiPMs, see the [arma] section
+# Parameters (in samples, see Config.pars.arma):
+#    tau is the decay time of the slow component
+#    sigma is the gaussian width of the response
+#    scale is the charge fraction of the slow component
+#    length is the template length (default: 5 tau)
+#
+# Gaussian fast component plus an exponential tail convolved with the same
+# gaussian, normalized to unit charge. Return the template starting 3 sigma
+# before the pulse onset, so that filtered peaks point to the onset.
+def ser_template(tau=67.5, sigma=1, scale=0.94, length=None):
+  length = int(np.ceil(5*tau + 6*sigma)) if length is None else int(length)
+  t      = np.arange(length) - 3*sigma
+  fast   = np.exp(-0.5*(t/sigma)**2)
+  slow   = np.exp(-np.clip(t, 0, None)/tau)*(t >= 0)
+  slow   = np.convolve(slow, fast/fast.sum())[:length]
+  ser    = (1 - scale)*fast/fast.sum() + scale*slow/slow.sum()
+  return ser/ser.sum()
+
+
+class MatchedFilter:
+  """FFT matched filter (correlation with a template) of waveform batches.
+  The rFFT of the template is computed once per FFT size and cached, each
+  batch costs one rfft/irfft pair along the sample axis. Waveforms longer
+  than 'long_wf' samples are processed with overlap-save blocks, all blocks
+  of the batch in the same rfft call.
+  Usage:
+    mf = MatchedFilter(ser_template(**arma))
+    out = mf(wfs)  # same shape as wfs, in units of template charges
+  """
+
+  def __init__(self, template, long_wf=1 << 16, normalize=True):
+    """Constructor.
+    Args:
+      template (array): filter template (e.g. from ser_template or a calibration run)
+      long_wf (int): waveform length above which overlap-save is used
+      normalize (bool): divide by the template energy, so a pulse equal to k templates peaks at k
+    """
+    self.template = np.asarray(template, dtype=np.float64)
+    self.long_wf  = long_wf
+    self.norm     = np.sum(self.template**2) if normalize else 1.
+    self.spectra  = {}
+
+  @classmethod
+  def from_config(cls, pars, **kwargs):
+    """Build the SER matched filter from the [arma] section of Config.pars."""
+    return cls(ser_template(pars.arma.tau, pars.arma.sigma, pars.arma.scale), **kwargs)
+
+  def spectrum(self, nfft):
+    """Return the conjugate rFFT of the template at size nfft, cached."""
+    if nfft not in self.spectra:
+      self.spectra[nfft] = np.conj(fft.rfft(self.template, nfft))/self.norm
+    return self.spectra[nfft]
+
+  def __call__(self, wfs):
+    """Return the filtered waveforms, y[t] = sum_k x[t+k] h[k], same shape as wfs."""
+    wfs = np.asarray(wfs, dtype=np.float64)
+    n, L = wfs.shape[-1], len(self.template)
+    if n <= self.long_wf:
+      nfft = fft.next_fast_len(n + L - 1, real=True)
+      return fft.irfft(fft.rfft(wfs, nfft, axis=-1)*self.spectrum(nfft), nfft, axis=-1)[..., :n]
+
+    # overlap-save: blocks of nfft samples stepping by nfft-L+1, valid outputs at the block start
+    nfft  = fft.next_fast_len(max(8*L, 4096), real=True)
+    step  = nfft - L + 1
+    nblk  = -(-n // step)
+    x     = np.pad(wfs, [(0, 0)]*(wfs.ndim - 1) + [(0, (nblk - 1)*step + nfft - n)])
+    blks  = np.lib.stride_tricks.sliding_window_view(x, nfft, axis=-1)[..., ::step, :]
+    y     = fft.irfft(fft.rfft(blks, axis=-1)*self.spectrum(nfft), nfft, axis=-1)[..., :step]
+    return y.reshape(wfs.shape[:-1] + (-1,))[..., :n]
+
+
+class TailDeconvolution:
+  """Recursive (IIR) inversion of the slow exponential component of the SiPM response.
+  With a = exp(-1/tau), the response (1-scale)*delta[n] + scale*(1-a)*a**n has the
+  z-transform ((1-scale*a) - (1-scale)*a/z)/(1 - a/z); its inverse is a first order
+  filter applied with one lfilter call along the sample axis of the whole batch,
+  O(n) per waveform. An optional gaussian smoothing tames the high frequency noise.
+  Usage:
+    deco = TailDeconvolution.from_config(config.pars)
+    out  = deco(wfs)  # same shape as wfs
+  """
+
+  def __init__(self, tau=67.5, scale=0.94, sigma=0):
+    """Constructor.
+    Args:
+      tau (float): decay time of the slow component in samples
+      scale (float): charge fraction of the slow component
+      sigma (float): gaussian smoothing in samples after the deconvolution, 0 for none
+    """
+    a = np.exp(-1/tau)
+    self.b     = np.array([1., -a])
+    self.a     = np.array([1 - scale*a, -(1 - scale)*a])
+    self.sigma = sigma
+
+  @classmethod
+  def from_config(cls, pars, smooth=True):
+    """Build the deconvolution from the [arma] section of Config.pars (sigma used for smoothing if smooth)."""
+    return cls(pars.arma.tau, pars.arma.scale, pars.arma.sigma if smooth else 0)
+
+  def __call__(self, wfs):
+    """Return the deconvolved waveforms (baseline subtracted input), same shape as wfs."""
+    out = lfilter(self.b, self.a, np.asarray(wfs, dtype=np.float64), axis=-1)
+    if self.sigma > 0: out = gaussian_filter1d(out, self.sigma, axis=-1)
+    return out
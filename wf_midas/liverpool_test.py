@@ -1,17 +1,17 @@
 #!/usr/bin/env python3
 
-import matplotlib
-#matplotlib.use("TkAgg")
-import matplotlib.pyplot as plt
 from midas_liverpool import MIDASreader
 from config import Config
 from algos import Algos
+from display import EventDisplay, minmax_decimate, draw_page
+from pipeline import Pipeline
+from roi import get_roi_windows
+from executor import Executor
+from cache import ResultCache
+from transport import get_batches
 import time
 import numpy as np
-
-import matplotlib.patches as mpatches
 import os, sys
-import pandas as pd
 #import msgpack
 
 
@@ -21,75 +21,61 @@ class AnaNA:
     self.algrt          = Algos(**configargs)
 
     # getting info from .ini files
-    self.sampling         = self.config('daq', 'sampling', 'float') # S/s
+    pars                  = self.config.pars
+    self.sampling         = pars.daq.sampling # S/s
     self.timebin          = 1e9/self.sampling # ns
-    self.baseline_tot      = self.config('reco', 'bl_to', 'int')
-    self.n_trig_events    = self.config('roi', 'n_trigs', 'int')
+    self.baseline_tot     = pars.reco.bl_to
+    self.n_trig_events    = pars.roi.n_trigs
     #Sample value to perform the running mean
-    self.running_mean_tot = self.config('pdm_reco','running_gate','int')
+    self.running_mean_tot = pars.pdm_reco.running_gate
     # number of samples to the left of the trigger position
-    self.roi_left_samples = self.config('roi', 'roi_low', 'int')
+    self.roi_left_samples = pars.roi.roi_low
     # total number of samples in the ROI
-    self.roi_tot_samples  = self.config('roi', 'roi_tot', 'int')
+    self.roi_tot_samples  = pars.roi.roi_tot
+
+    # event display writing to PDF in a background process (-v flag)
+    self.display = None
+    if self.config.pdf is not None:
+      self.display = EventDisplay(self.config.pdf, sampling=self.sampling, max_events=pars.view.nbmax_wf)
 
 
   def plot_wf(self,wfs):
-    x = np.linspace(0,len(wfs[0])/125,len(wfs[0]))
-    # Create a 2x2 grid of subplots
-    fig, axs = plt.subplots(2, 2, figsize=(12, 8))
-    # Plot data on each subplot
-    axs[0, 0].plot(x,wfs[0],linewidth=0.5,color='k')
-    axs[0, 0].set_title('Ch 0')
-    axs[0, 0].set_xlabel('Time (us)')
-    axs[0, 0].set_ylabel('Voltage (ADC)')
-
-    axs[0, 1].plot(x,wfs[1],linewidth=0.5,color='k')
-    axs[0, 1].set_title('Ch 1')
-    axs[0, 1].set_xlabel('Time (us)')
-    axs[0, 1].set_ylabel('Voltage (ADC)')
-
-
-    axs[1, 0].plot(x,wfs[2],linewidth=0.5,color='k')
-    axs[1, 0].set_title('Ch 2')
-    axs[1, 0].set_xlabel('Time (us)')
-    axs[1, 0].set_ylabel('Voltage (ADC)')
-
-    axs[1, 1].plot(x,wfs[3],linewidth=0.5,color='k')
-    axs[1, 1].set_title('Ch 3')
-    axs[1, 1].set_xlabel('Time (us)')
-    axs[1, 1].set_ylabel('Voltage (ADC)')
-
-    plt.tight_layout()
-    plt.show()
-    plt.close()
-
-    # Create a 2x2 grid of subplots
-    fig1, axs1 = plt.subplots(2, 2, figsize=(12, 8))
-
-    # Plot data on each subplot
-    axs1[0, 0].plot(x,wfs[4],linewidth=0.5,color='k')
-    axs1[0, 0].set_title('Ch 4')
-    axs1[0, 0].set_xlabel('Time (us)')
-    axs1[0, 0].set_ylabel('Voltage (ADC)')
-
-    axs1[0, 1].plot(x,wfs[5],linewidth=0.5,color='k')
-    axs1[0, 1].set_title('Ch 5')
-    axs1[0, 1].set_xlabel('Time (us)')
-    axs1[0, 1].set_ylabel('Voltage (ADC)')
-
-    axs1[1, 0].plot(x,wfs[6],linewidth=0.5,color='k')
-    axs1[1, 0].set_title('Ch 6')
-    axs1[1, 0].set_xlabel('Time (us)')
-    axs1[1, 0].set_ylabel('Voltage (ADC)')
-
-    axs1[1, 1].plot(x,wfs[7],linewidth=0.5,color='k')
-    axs1[1, 1].set_title('Ch 7')
-    axs1[1, 1].set_xlabel('Time (us)')
-    axs1[1, 1].set_ylabel('Voltage (ADC)')
-
-    plt.tight_layout()
-    plt.show()
-    plt.close()
+    # interactive view of an event, decimated to min/max envelopes
+    import matplotlib.pyplot as plt # loaded on demand, it costs seconds at startup
+    x, ys = minmax_decimate(wfs)
+    for i in range(0, len(ys), 4):
+      fig = plt.figure(figsize=(12, 8))
+      draw_page(fig, x/self.sampling*1e6, ys[i:i+4], np.arange(i, min(i+4, len(ys))))
+      plt.show()
+      plt.close()
+
+
+  # reconstruction of one unpacked event, run in the reco thread of the pipeline
+  # returns (event, {sink: output}) with the sinks of [executor], None for empty events
+  def process_event(self, event):
+    if event is None or event.nchannels == 0:
+      return event, None
+
+    #Stages (baseline, subtraction, ROI, running mean, ...) declared in the [executor] section
+    return event, self.executor(event.adc_data)
+
+
+  # batches of raw waveforms (event, channel, sample) of one subrun
+  def subrun_batches(self, fname, batch_size):
+    reader = MIDASreader(manager=self, files=[fname])
+    for batch in get_batches((reader.unpack(ev) for ev in reader.raw_events()), batch_size):
+      yield np.stack([ev.adc_data for ev in batch])
+
+
+  # reconstruction through the result cache ([cache] enabled), one subrun at a time:
+  # stages whose inputs and parameters did not change are loaded instead of recomputed
+  # yields the {sink: output} of each batch
+  def reco_cached(self):
+    cache = ResultCache.from_config(self.config.pars)
+    bsize = self.config.pars.cache.batch_size
+    for fname in MIDASreader.get_files(self.config.input):
+      batches = lambda fname=fname: self.subrun_batches(fname, bsize)
+      yield from cache.run(self.executor, cache.source(fname, bsize), batches)
 
 
   def reco(self):
@@ -98,19 +84,45 @@ class AnaNA:
      t0 = time.time()
      t1 = t0
      
+     #ROI and baseline windows from the first events of the run (cached per run)
+     if self.config.pars.roi.auto:
+       win = get_roi_windows(self.config, lambda: MIDASreader(manager=self))
+       self.roi_left_samples = win['roi_low']
+       self.roi_tot_samples  = win['roi_tot']
+       self.baseline_tot     = win['bl_to']
+
+     #Reconstruction stages, with the windows in use
+     self.executor = Executor(self.config.pars, windows={'bl_to': self.baseline_tot,
+                                                         'roi_low': self.roi_left_samples,
+                                                         'roi_tot': self.roi_tot_samples})
+
+     #Batches of each subrun through the result cache
+     if self.config.pars.cache.enabled:
+       nbatch = 0
+       for outs in self.reco_cached():
+         if self.display is not None and 'filtered' in outs:
+           for i, wfs in enumerate(outs['filtered']):
+             self.display.draw(wfs, label=f'Batch {nbatch} ev {i}')
+         nbatch += 1
+       print(f'{nbatch} batches {time.time()-t0:1.3f}s')
+       if self.display is not None:
+         self.display.close()
+       return
+
      #Reading the midas file
      self.events   = MIDASreader(manager=self)
       
      empty_event = 0 
+
+     #Reading/decompression, unpacking and reconstruction run in their own threads,
+     #the outputs come back here in order (output thread)
+     pipe = Pipeline(self.events.raw_events(), [self.events.unpack, self.process_event],
+                     maxsize=self.config.pars.base.pipeline_queue)
      
      #Loop to extract information from each events in all channels
-     for nev, event in enumerate(self.events):
+     for nev, (event, outs) in enumerate(pipe):
         #Summing the number of empty events
-        if event is None:
-          empty_event += 1
-          continue
-
-        if event.nchannels == 0: 
+        if outs is None:
           empty_event += 1
           continue
 
@@ -118,24 +130,13 @@ class AnaNA:
           print(f'{nev:6d} events {time.time()-t1:1.3f}s / 1000 ev')
           t1 = time.time()
 
-        #Retreving waveforms and general recontruction analysis
-        bal = self.algrt.get_baseline(event.adc_data, gate=self.baseline_tot) #Getting the baseline of waveforms
-        rms = self.algrt.get_rms(event.adc_data, gate=self.baseline_tot) #Getting the baseline RMS of waveforms
-        wfs = 1 * (event.adc_data - bal) #Baseline subtraction
-        roi = self.algrt.get_roi(wfs, gate=self.roi_tot_samples, start=self.roi_left_samples) #ROI "integration by summing the array values together"
-        wfsRM = self.algrt.running_mean(wfs, gate =self.running_mean_tot) #Executing a running mean algorythm to smoothen out the waveforms
-        
+        if self.display is not None and 'filtered' in outs:
+          self.display.draw(outs['filtered'], label=f'Ev {nev}')
 
-        #self.plot_wf(wfsRM)
-        
+     if self.display is not None:
+       self.display.close()
 
 
-
-
-        
-        
-     
-
 if __name__ == '__main__':
 
   r = AnaNA()
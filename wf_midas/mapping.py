@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Channel -> PDM remapping, see the [mapping] section.
+# The maps are compiled once per run into flat (channel, pdm, weight)
+# index arrays; a batch of charges, matrix defined as (event, channel),
+# is then turned into (event, m, n) grid images with a single bincount.
+# A channel reading several PDMs (summed readout) shares its charge
+# equally among them. A table gives one channel per PDM; maps where
+# several channels read the same PDM are given as (channel, pdm) pairs,
+# their charges are then added up.
+
+import numpy as np
+
+
+class ChannelMap:
+  """Compiled channel -> PDM map.
+  Usage:
+    cmap   = ChannelMap.from_config(config.pars)
+    cmap   = ChannelMap.from_pairs([(0, 0, 0), (1, 0, 0), (1, 0, 1)], (5, 5))  # (channel, row, col)
+    images = cmap.images(charges)  # (event, channel) -> (event, m, n)
+  """
+
+  def __init__(self, channels, pdms, shape):
+    """Constructor.
+    Args:
+      channels (array): channel of each (channel, pdm) pair
+      pdms (array): PDM of each pair, row-major index on the grid
+      shape (tuple): grid shape (m, n)
+    """
+    self.shape   = tuple(shape)
+    self.channel = np.asarray(channels, dtype=int).reshape(-1)
+    self.pdm     = np.asarray(pdms, dtype=int).reshape(-1)
+    if len(self.channel) != len(self.pdm):
+      raise ValueError(f'{len(self.channel)} channels for {len(self.pdm)} PDMs in the (channel, pdm) pairs.')
+    self.npdms = int(np.prod(self.shape))
+    if len(self.pdm) and (self.pdm.min() < 0 or self.pdm.max() >= self.npdms):
+      raise ValueError(f'PDM index out of the {self.shape} grid.')
+    self.weight    = 1/np.bincount(self.channel)[self.channel]
+    self.nchannels = self.channel.max() + 1 if len(self.channel) else 0
+
+  @classmethod
+  def from_table(cls, table, shape=None):
+    """Map from the channel read by each PDM, table of shape (m, n) with -1 for none."""
+    table = np.asarray(table, dtype=int)
+    table = table.reshape(table.shape if shape is None else shape)
+    pdm   = np.flatnonzero(table >= 0)
+    return cls(table.reshape(-1)[pdm], pdm, table.shape)
+
+  @classmethod
+  def from_pairs(cls, pairs, shape):
+    """Map from (channel, pdm) pairs, pdm given as (row, col) or row-major index.
+    Several channels may read the same PDM and one channel several PDMs.
+    """
+    pairs = np.asarray(pairs, dtype=int).reshape(len(pairs), -1)
+    pdm   = pairs[:, 1] if pairs.shape[1] == 2 else np.ravel_multi_index((pairs[:, 1], pairs[:, 2]), shape)
+    return cls(pairs[:, 0], pdm, shape)
+
+  @classmethod
+  def identity(cls, m=5, n=5):
+    """Channel i reads PDM i (row-major)."""
+    return cls.from_table(np.arange(m*n).reshape(m, n))
+
+  @classmethod
+  def blocks(cls, m=5, n=5, size=2):
+    """One channel per size x size block of PDMs, numbered row-major."""
+    rows, cols = np.indices((m, n))
+    return cls.from_table((rows//size)*(-(-n//size)) + cols//size)
+
+  @classmethod
+  def from_config(cls, pars):
+    """Compile the map described by the [mapping] and [xyreco] sections of Config.pars."""
+    m, n = pars.xyreco.m_pdms, pars.xyreco.n_pdms
+    if not pars.mapping.is_remap:
+      return cls.identity(m, n)
+    if pars.mapping.map_type == '2x2':
+      return cls.blocks(m, n, 2)
+    if pars.mapping.map_type == '5x5':
+      if not pars.mapping.is_symmetric:
+        return cls.from_table(pars.mapping.full_map, (m, n))
+      # lower triangle given, mirror it on the -1 entries
+      table = np.array(pars.mapping.corner_map).reshape(m, n)
+      return cls.from_table(np.where(table >= 0, table, table.T), (m, n))
+    if pars.mapping.map_type == 'pairs':
+      return cls.from_pairs(pars.mapping.pairs, (m, n))
+    raise ValueError(f"Map type '{pars.mapping.map_type}' not implemented.")
+
+  def images(self, q):
+    """Return the (event, m, n) images of (event, channel) charges."""
+    q    = np.atleast_2d(q)
+    nevs = len(q)
+    idx  = (np.arange(nevs).reshape(-1, 1)*self.npdms + self.pdm).reshape(-1)
+    img  = np.bincount(idx, weights=(q[:, self.channel]*self.weight).reshape(-1), minlength=nevs*self.npdms)
+    return img.reshape((nevs,) + self.shape)
@@ -23,19 +23,13 @@ class MIDASreader:
         event.adc_data # shape = (number of channels, number of waveform sample)
 
     '''
-    def __init__(self, manager):
+    def __init__(self, manager, files=None):
         self.m  = manager
-        try:
-            if os.path.isdir(self.m.config.input):
-                print(f'{self.m.config.input} is a directory')
-                # get list of midas files, exclude odb dumps (*.json)
-                # compressed (*.mid.lz4, *.mid.gz) or uncompressed
-                self.midas_files  = glob.glob(f'{self.m.config.input}/*mid*')
-                # ensure subruns are processed in chrnonological order
-                self.midas_files.sort()
-        except TypeError:
-            # copy the list of files
-            self.midas_files  = self.m.config.input
+        if files is not None:
+            # explicit list of files, e.g. one subrun at a time
+            self.midas_files  = list(files)
+        else:
+            self.midas_files  = self.get_files(self.m.config.input)
 
         self.subidx=0
         self.__next_subrun__()
@@ -51,6 +45,24 @@ class MIDASreader:
         self.ADCbanks = MIDASconf[self.data_format]['BANKS']           # banks_list
         self.event_number=0
 
+    @staticmethod
+    def get_files(inputs):
+        '''
+         list of MIDAS files (subruns) of the input, a directory or a list of files,
+         without opening them
+        '''
+        try:
+            if os.path.isdir(inputs):
+                print(f'{inputs} is a directory')
+                # get list of midas files, exclude odb dumps (*.json)
+                # compressed (*.mid.lz4, *.mid.gz) or uncompressed
+                # ensure subruns are processed in chrnonological order
+                return sorted(glob.glob(f'{inputs}/*mid*'))
+        except TypeError:
+            pass
+        # copy the list of files
+        return inputs
+
     def isADCbank(self,current_bank):
         '''
         ensure that the data from ADCs and not from other equipment
@@ -83,30 +95,49 @@ class MIDASreader:
          main function to unpack ADC data
          returns waveform array (number of channels, number of samples)
         '''
-        for event in self.mfile:
-            if event.header.is_midas_internal_event():
-                if event.header.is_eor_event():
-                    self.__next_subrun__()
-                    return self.read()
-                continue
-            
-            if self.data_format == 'V1725':
-                raw = unpack_V1725()
-            elif self.data_format == 'V1730':
-                raw = unpack_V1730()
-            elif self.data_format == 'VX2740':
-                raw = unpack_VX2740()
-            elif self.data_format == 'VX2745':
-                raw = unpack_VX2740()
+        for event in self.raw_events():
+            return self.unpack(event)
+
+    def raw_events(self):
+        '''
+         generator over the MIDAS events with data, across subruns
+         reading (and decompression) only, see unpack()
+        '''
+        while True:
+            for event in self.mfile:
+                if event.header.is_midas_internal_event():
+                    if event.header.is_eor_event():
+                        break
+                    continue
+                yield event
             else:
-                raise ValueError(f'Unknown ADC model {self.ADCmodel}\nAvailable models V1725, V1730, VX2740')
+                return
+            if self.subidx >= len(self.midas_files):
+                return
+            self.__next_subrun__()
+
+    def unpack(self,event):
+        '''
+         unpack the ADC banks of a MIDAS event
+         returns waveform array (number of channels, number of samples)
+        '''
+        if self.data_format == 'V1725':
+            raw = unpack_V1725()
+        elif self.data_format == 'V1730':
+            raw = unpack_V1730()
+        elif self.data_format == 'VX2740':
+            raw = unpack_VX2740()
+        elif self.data_format == 'VX2745':
+            raw = unpack_VX2740()
+        else:
+            raise ValueError(f'Unknown ADC model {self.ADCmodel}\nAvailable models V1725, V1730, VX2740')
 
-            for bank_name, bank in event.banks.items():
-                if len(bank.data) and self.isADCbank(bank_name):
-                    raw.unpack(bank.data)
+        for bank_name, bank in event.banks.items():
+            if len(bank.data) and self.isADCbank(bank_name):
+                raw.unpack(bank.data)
 
-            raw.midas_event=event.header.serial_number
-            return raw
+        raw.midas_event=event.header.serial_number
+        return raw
                     
 
 class unpack_ADC:
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Streaming noise power spectrum, see [daq] noise_spectrum.
+# Welch's method accumulated over batches of waveforms, matrix defined as
+# (event, channel, sample) or (channel, sample): every batch is cut in
+# overlapping windowed segments, transformed with one rfft and added to
+# running float64 sums, so memory does not depend on the number of events.
+
+import numpy as np
+from scipy import fft
+from scipy.signal import get_window
+
+
+class NoiseSpectrum:
+  """Welch power spectral density of each channel and cross-spectral matrix between channels.
+  Accumulators of different processes are combined with merge().
+  Usage:
+    ns = NoiseSpectrum(nchannels=64, nperseg=256, sampling=125e6)
+    for wfs in batches:
+      ns.add(wfs[..., :baseline_samples])  # baseline region or random triggers
+    ns.save(config('daq', 'noise_spectrum'))
+  """
+
+  def __init__(self, nchannels, nperseg=256, sampling=125e6, window='hann', cross=True):
+    """Constructor.
+    Args:
+      nchannels (int): number of channels
+      nperseg (int): samples per segment, segments overlap by half
+      sampling (float): sampling rate in S/s
+      window (str, tuple): window passed to scipy.signal.get_window
+      cross (bool): also accumulate the (channel, channel) cross-spectral matrix
+    """
+    self.nperseg  = nperseg
+    self.sampling = sampling
+    self.window   = get_window(window, nperseg)
+    self.freqs    = fft.rfftfreq(nperseg, 1/sampling)
+    self.count    = 0
+    self.psd_sum  = np.zeros((nchannels, len(self.freqs)))
+    self.csd_sum  = np.zeros((nchannels, nchannels, len(self.freqs)), dtype=np.complex128) if cross else None
+
+  def add(self, wfs):
+    """Add the segments of a batch of waveforms (..., channel, sample) with at least nperseg samples."""
+    wfs  = np.asarray(wfs, dtype=np.float64)
+    wfs  = wfs.reshape((-1,) + wfs.shape[-2:])
+    segs = np.lib.stride_tricks.sliding_window_view(wfs, self.nperseg, axis=-1)[..., ::self.nperseg//2, :]
+    if segs.shape[2] == 0: return
+    segs = segs - segs.mean(axis=-1, keepdims=True)  # constant detrend
+    X    = fft.rfft(segs*self.window, axis=-1)        # (event, channel, segment, freq)
+
+    self.count   += X.shape[0]*X.shape[2]
+    self.psd_sum += np.sum(X.real**2 + X.imag**2, axis=(0, 2))
+    if self.csd_sum is not None:
+      # one (channel, segment) @ (segment, channel) product per frequency, on BLAS
+      X = np.ascontiguousarray(X.transpose(3, 1, 0, 2)).reshape(X.shape[3], X.shape[1], -1)  # (freq, channel, segment)
+      self.csd_sum += (X.conj() @ X.transpose(0, 2, 1)).transpose(1, 2, 0)  # as scipy.signal.csd(x_i, x_j)
+
+  def merge(self, other):
+    """Add the accumulators of another NoiseSpectrum (e.g. from a worker process)."""
+    self.count   += other.count
+    self.psd_sum += other.psd_sum
+    if self.csd_sum is not None and other.csd_sum is not None:
+      self.csd_sum += other.csd_sum
+    return self
+
+  def __scale(self):
+    # one-sided density, as scipy.signal.welch(scaling='density')
+    scale = np.full(len(self.freqs), 2/(self.sampling*np.sum(self.window**2)*max(self.count, 1)))
+    scale[0] /= 2
+    if self.nperseg % 2 == 0: scale[-1] /= 2
+    return scale
+
+  @property
+  def psd(self):
+    """Averaged power spectral density (channel, freq) in units^2/Hz."""
+    return self.psd_sum*self.__scale()
+
+  @property
+  def csd(self):
+    """Averaged cross-spectral density (channel, channel, freq) in units^2/Hz."""
+    return None if self.csd_sum is None else self.csd_sum*self.__scale()
+
+  def save(self, fname):
+    """Write frequencies, psd, csd and number of segments to a .npz file."""
+    out = {'freqs': self.freqs, 'psd': self.psd, 'count': self.count}
+    if self.csd_sum is not None: out['csd'] = self.csd
+    np.savez(fname, **out)
+    print(f'Noise spectrum: {self.count} segments written to {fname}')
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Threaded pipeline: the source and every stage run in their own thread,
+# connected by bounded queues. A full queue blocks the stage feeding it
+# (backpressure), so memory stays bounded and the throughput approaches the
+# one of the slowest stage. NumPy and zlib release the GIL for most of their
+# work, so reading, unpacking and reconstruction overlap even in one process.
+
+import queue
+import threading
+
+_END = object()  # end-of-stream marker
+
+
+class Pipeline:
+  """Run source -> stage 1 -> ... -> stage N in separate threads.
+  Iterating over the pipeline yields the outputs of the last stage in the
+  order of the source, in the calling thread (e.g. the output writer).
+  A stage returning None drops the item. The first exception raised in any
+  thread stops all of them and is re-raised by the iteration.
+  Usage:
+    pipe = Pipeline(reader.raw_events(), [reader.unpack, ana.process_event], maxsize=16)
+    for out in pipe:
+      write(out)
+  """
+
+  def __init__(self, source, stages, maxsize=8):
+    """Constructor.
+    Args:
+      source (iterable): input items, iterated in its own thread until StopIteration
+      stages (list): functions applied in sequence, one thread each
+      maxsize (int): capacity of each queue between two threads
+    """
+    self.source  = source
+    self.stages  = list(stages)
+    self.queues  = [queue.Queue(maxsize=maxsize) for _ in range(len(self.stages) + 1)]
+    self.stop    = threading.Event()
+    self.error   = None
+    self.threads = []
+
+  def _fail(self, exc):
+    if self.error is None: self.error = exc
+    self.stop.set()
+
+  # put/get that give up when the pipeline is stopped
+  def _put(self, q, item):
+    while not self.stop.is_set():
+      try:
+        q.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def _get(self, q):
+    while not self.stop.is_set():
+      try:
+        return q.get(timeout=0.1)
+      except queue.Empty:
+        pass
+    return _END
+
+  def _feed(self, qout):
+    try:
+      for item in self.source:
+        if not self._put(qout, item): return
+      self._put(qout, _END)
+    except BaseException as exc:
+      self._fail(exc)
+
+  def _work(self, func, qin, qout):
+    try:
+      while True:
+        item = self._get(qin)
+        if item is _END:
+          self._put(qout, _END)
+          return
+        out = func(item)
+        if out is not None and not self._put(qout, out): return
+    except BaseException as exc:
+      self._fail(exc)
+
+  def start(self):
+    """Start the threads, called by the iteration if needed."""
+    if self.threads: return
+    self.threads.append(threading.Thread(target=self._feed, args=(self.queues[0],), name='source', daemon=True))
+    for i, func in enumerate(self.stages):
+      self.threads.append(threading.Thread(target=self._work, args=(func, self.queues[i], self.queues[i+1]),
+                                           name=getattr(func, '__name__', f'stage{i}'), daemon=True))
+    for t in self.threads: t.start()
+
+  def close(self):
+    """Stop and join all threads."""
+    self.stop.set()
+    for t in self.threads: t.join()
+
+  def __iter__(self):
+    self.start()
+    try:
+      while True:
+        out = self._get(self.queues[-1])
+        if out is _END: break
+        yield out
+    finally:
+      self.close()
+    if self.error is not None: raise self.error
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Automatic ROI (region of interest) and baseline windows, see [roi] auto.
+# A pre-pass reads the first n_trigs events in batches, averages the
+# channel-summed waveforms and finds the trigger position on the average.
+# The windows are stored per run in a small JSON file keyed by the input
+# files and by a hash of the [daq], [roi] and [reco] sections, so
+# reprocessing a run and every worker process reuse them without reading
+# events again. If the trigger leaves less than [roi] min_bl samples
+# before the ROI, the configured [reco] bl_to is kept for the baseline.
+
+from itertools import islice
+import hashlib
+import json
+import os
+import numpy as np
+from midas_liverpool import MIDASreader
+from transport import get_batches
+
+
+# Average of the channel-summed waveforms of the first n_trigs events
+# Parameters:
+#    events is an iterable of unpacked events (see midas_liverpool.py)
+#    n_trigs is the number of events to average
+#
+# Events are stacked by batches of equal shape, only those with the shape
+# of the first batch are used. Return (average, number of events).
+def average_waveform(events, n_trigs=100, batch_size=100):
+  total, count = None, 0
+  for batch in get_batches(islice(events, n_trigs), batch_size):
+    wfs = np.stack([ev.adc_data for ev in batch]).sum(axis=1, dtype=np.int64)  # (event, sample)
+    if total is None:
+      total = np.zeros(wfs.shape[-1], dtype=np.int64)
+    elif wfs.shape[-1] != len(total):
+      continue
+    total += wfs.sum(axis=0)
+    count += len(wfs)
+  if total is None:
+    raise ValueError('No events with data to determine the trigger position.')
+  return total/count, count
+
+
+# ROI and baseline windows from an averaged waveform
+# Parameters:
+#    avg is the averaged (channel-summed) waveform
+#    pre_trigger is the number of samples kept before the trigger position
+#    end_frac is the fraction of the amplitude ending the ROI after the peak
+#    frac is the fraction of the amplitude defining the trigger position
+#
+# The baseline is the median of the average (the pulse covers less than half
+# of the gate), the polarity is the one of the largest excursion. The trigger
+# is the first sample of the rising edge above frac of the amplitude.
+# Return a dict with trigger, roi_low, roi_tot and bl_to, in samples.
+def get_windows(avg, pre_trigger=50, end_frac=0.01, frac=0.5):
+  sig  = avg - np.median(avg)
+  sig  = sig if sig.max() >= -sig.min() else -sig
+  peak = int(np.argmax(sig))
+  amp  = sig[peak]
+
+  below   = np.flatnonzero(sig[:peak] < frac*amp)
+  trigger = int(below[-1]) + 1 if len(below) else 0
+  after   = np.flatnonzero(sig[peak:] < end_frac*amp)
+  end     = peak + int(after[0]) if len(after) else len(sig)
+
+  roi_low = max(trigger - pre_trigger, 0)
+  return {'trigger': trigger, 'roi_low': roi_low, 'roi_tot': end - roi_low, 'bl_to': roi_low}
+
+
+# Key of the pre-pass result: run, input files (name, size, mtime of every
+# subrun of an input directory) and the hash of the sections it depends on
+def get_key(config):
+  files = MIDASreader.get_files(config.input)
+  ident = [(os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f)) for f in files]
+  return hashlib.sha1(repr((config.run, ident, config.hash('daq', 'roi', 'reco'))).encode()).hexdigest()[:16]
+
+
+# ROI and baseline windows of the run, from the cache or from a pre-pass
+# Parameters:
+#    config is the Config of the run
+#    reader is a function returning a new iterable over the unpacked events,
+#      called only when the windows are not cached
+def get_roi_windows(config, reader):
+  pars  = config.pars.roi
+  fname = os.path.join(pars.cache_dir, f'roi_run{config.run}_{get_key(config)}.json')
+  if os.path.isfile(fname):
+    with open(fname) as f:
+      return json.load(f)
+
+  avg, count = average_waveform(reader(), pars.n_trigs)
+  out = get_windows(avg, pars.pre_trigger, pars.end_frac)
+  out['n_trigs'] = count
+  if out['bl_to'] - config.pars.reco.bl_from < pars.min_bl:
+    print(f"Warning: only {out['bl_to']} samples before the ROI, "
+          f"keeping [reco] bl_to = {config.pars.reco.bl_to} for the baseline")
+    out['bl_to'] = config.pars.reco.bl_to
+  print(f"ROI from {count} events: trigger at sample {out['trigger']}, "
+        f"roi_low = {out['roi_low']}, roi_tot = {out['roi_tot']}, bl_to = {out['bl_to']}")
+
+  # atomic write, workers of the same run may race
+  os.makedirs(pars.cache_dir, exist_ok=True)
+  tmp = f'{fname}.{os.getpid()}.tmp'
+  with open(tmp, 'w') as f:
+    json.dump(out, f)
+  os.replace(tmp, fname)
+  return out
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Saturation and clipping flags of raw waveforms, see [sipm] sat_threshold_sumamp,
+# sat_threshold_tia and [daq] bits, mVpp, mVoffset.
+# Thresholds are converted to ADC counts once; batches of raw waveforms,
+# matrix defined as (event, channel, sample) or (channel, sample), are compared
+# in their integer dtype before any conversion to float.
+
+import numpy as np
+
+# flag table returned by Saturation.__call__, one row per (event, channel)
+SAT_DTYPE = np.dtype([('nsat',  'i4'),   # number of saturated samples
+                      ('first', 'i4'),   # first saturated sample, -1 if none
+                      ('last',  'i4'),   # last saturated sample, -1 if none
+                      ('nclip', 'i4')])  # number of samples at the ADC rails
+
+
+# Convert mV to ADC counts of a digitizer with 'bits' bits covering mVpp
+# centered on mVoffset, clipped to the ADC range
+def mV_to_adc(mV, bits=14, mVpp=2000, mVoffset=-800):
+  counts = np.round((np.asarray(mV, dtype=float) - mVoffset + mVpp/2)/mVpp*(1 << bits))
+  return np.clip(counts, 0, (1 << bits) - 1).astype(np.int64)
+
+
+class Saturation:
+  """Per-channel saturation flags of raw waveforms.
+  A sample is saturated beyond the threshold of its channel, on the side of the
+  pulses: at or below it for thresholds under the middle of the ADC range
+  (negative pulses), at or above it otherwise.
+  Usage:
+    sat   = Saturation.from_config(config.pars, nchannels=64)
+    flags = sat(raw)               # SAT_DTYPE (event, channel)
+    skip  = sat.is_saturated(flags) # (event,) events with a saturated channel
+  """
+
+  def __init__(self, thresholds, bits=14):
+    """Constructor.
+    Args:
+      thresholds (array): saturation threshold of each channel in ADC counts
+      bits (int): ADC resolution, the rails are 0 and 2**bits-1
+    """
+    self.thresholds = np.asarray(thresholds, dtype=np.int64)
+    self.below      = self.thresholds < (1 << (bits - 1))
+    self.top        = (1 << bits) - 1
+
+  @classmethod
+  def from_config(cls, pars, nchannels):
+    """Build the flags from the [sipm] and [daq] sections of Config.pars.
+    Channels in [sipm] tia_channels use sat_threshold_tia, the others sat_threshold_sumamp.
+    """
+    daq = pars.daq
+    mV  = np.full(nchannels, float(pars.sipm.sat_threshold_sumamp))
+    tia = np.asarray(pars.sipm.get('tia_channels', []), dtype=int)
+    mV[tia[tia < nchannels]] = pars.sipm.sat_threshold_tia
+    return cls(mV_to_adc(mV, daq.bits, daq.mvpp, daq.mvoffset), daq.bits)
+
+  def __call__(self, raw):
+    """Return the SAT_DTYPE flags of raw waveforms (..., channel, sample), shaped raw.shape[:-1]."""
+    raw  = np.asarray(raw)
+    n    = raw.shape[-1]
+    thr  = self.thresholds[:raw.shape[-2], None].astype(raw.dtype)
+    low  = self.below[:raw.shape[-2], None]
+    if low.all():  # usual case, one comparison
+      mask = raw <= thr
+    else:
+      mask = np.where(low, raw <= thr, raw >= thr)
+
+    flags = np.empty(raw.shape[:-1], dtype=SAT_DTYPE)
+    flags['nsat']  = np.count_nonzero(mask, axis=-1)
+    flags['nclip'] = np.count_nonzero((raw == 0) | (raw == self.top), axis=-1)
+    hit = flags['nsat'] > 0
+    flags['first'] = np.where(hit, np.argmax(mask, axis=-1), -1)
+    flags['last']  = np.where(hit, n - 1 - np.argmax(mask[..., ::-1], axis=-1), -1)
+    return flags
+
+  @staticmethod
+  def is_saturated(flags):
+    """Return the events (or channels for 1d flags) with at least one saturated sample."""
+    return flags['nsat'].any(axis=-1) if flags.ndim > 1 else flags['nsat'] > 0
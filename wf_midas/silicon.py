@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Silicon detector dE/dx analysis (dedx_fast), see the [silicon] section.
+# Batches of waveforms, matrix defined as (event, channel, sample) or
+# (channel, sample), are flattened to one row per channel; signals of all
+# rows are found at once and their minimum and fast/slow maxima come from
+# argmin/argmax over windows gathered from strided views, without a Python
+# loop over events, channels or signals.
+
+import numpy as np
+
+# signal table returned by SiliconReco.__call__, one row per signal (times in samples,
+# amplitudes relative to the baseline)
+SILICON_DTYPE = np.dtype([('event',    'i4'),
+                          ('channel',  'i4'),
+                          ('start',    'i4'),   # first sample below threshold
+                          ('t_min',    'i4'),
+                          ('min',      'f4'),
+                          ('t_fast',   'i4'),
+                          ('fast',     'f4'),   # maximum within max_from_min after the minimum
+                          ('t_slow',   'i4'),
+                          ('slow',     'f4'),   # maximum from max_from_min to range_max_slow after the minimum
+                          ('baseline', 'f4'),
+                          ('rms',      'f4')])
+
+
+class SiliconReco:
+  """Batched fast/slow analysis of silicon detector signals.
+  A signal starts where the waveform goes below the baseline by 'threshold'
+  baseline rms; threshold crossings closer than 'distance' to the previous
+  one belong to the same signal. The minimum is searched within 'distance'
+  from the start, the fast maximum within 'max_from_min' after the minimum
+  and the slow maximum between 'max_from_min' and 'range_max_slow' after it.
+  Usage:
+    si  = SiliconReco.from_config(config.pars)
+    sig = si(wfs)  # SILICON_DTYPE table
+  """
+
+  def __init__(self, threshold=6, distance=500, bl_samples=1000, max_from_min=200, range_max_slow=700):
+    """Constructor.
+    Args:
+      threshold (float): threshold in number of baseline rms
+      distance (int): minimum distance in samples between two signals
+      bl_samples (int): samples at the start of the waveform used for the baseline mean and rms
+      max_from_min (int): samples after the minimum searched for the fast maximum
+      range_max_slow (int): samples after the minimum up to which the slow maximum is searched
+    """
+    self.threshold      = threshold
+    self.distance       = int(distance)
+    self.bl_samples     = int(bl_samples)
+    self.max_from_min   = int(max_from_min)
+    self.range_max_slow = max(int(range_max_slow), self.max_from_min + 1)
+
+  @classmethod
+  def from_config(cls, pars):
+    """Build the analysis from the [silicon] section of Config.pars."""
+    si = pars.silicon
+    return cls(si.threshold, si.distance, si.bl_samples, si.max_from_min, si.range_max_slow)
+
+  # Position and value of the extremum of the padded rows xp over windows [starts, starts+length),
+  # windows are cut at the end of the waveform (n samples), empty ones give (-1, nan)
+  @staticmethod
+  def __extremum(xp, n, rows, starts, length, func):
+    starts = np.minimum(starts, n)
+    win    = np.lib.stride_tricks.sliding_window_view(xp, length, axis=1)[rows, starts]  # (signal, length)
+    i      = func(win, axis=1)
+    val    = win[np.arange(len(i)), i]
+    ok     = np.isfinite(val)
+    return np.where(ok, starts + i, -1), np.where(ok, val, np.nan)
+
+  def __call__(self, wfs):
+    """Return the SILICON_DTYPE signals of a batch of waveforms (..., channel, sample)."""
+    wfs   = np.asarray(wfs)
+    nch, n = wfs.shape[-2], wfs.shape[-1]
+    x     = wfs.reshape(-1, n).astype(np.float64)
+    bl    = x[:, :self.bl_samples].mean(axis=1, keepdims=True)
+    rms   = x[:, :self.bl_samples].std(axis=1, keepdims=True)
+    x    -= bl
+
+    # threshold crossings after the baseline region, merged when closer than distance
+    below = x[:, self.bl_samples:] < -self.threshold*rms
+    edge  = below.copy()
+    edge[:, 1:] &= ~below[:, :-1]
+    rows, starts = np.nonzero(edge)
+    starts = starts + self.bl_samples
+    keep   = np.ones(len(rows), dtype=bool)
+    keep[1:] = (rows[1:] != rows[:-1]) | (starts[1:] - starts[:-1] >= self.distance)
+    rows, starts = rows[keep], starts[keep]
+
+    # rows padded with values never selected, so that windows may run past the end
+    pad  = max(self.distance, self.range_max_slow)
+    low  = np.pad(x, ((0, 0), (0, pad)), constant_values=np.inf)
+    t_min, v_min = self.__extremum(low, n, rows, starts, self.distance, np.argmin)
+    del low
+    high = np.pad(x, ((0, 0), (0, pad)), constant_values=-np.inf)
+    t_fast, v_fast = self.__extremum(high, n, rows, t_min, self.max_from_min, np.argmax)
+    t_slow, v_slow = self.__extremum(high, n, rows, t_min + self.max_from_min,
+                                     self.range_max_slow - self.max_from_min, np.argmax)
+
+    out = np.empty(len(rows), dtype=SILICON_DTYPE)
+    out['event'], out['channel'] = rows//nch, rows % nch
+    out['start'] = starts
+    out['t_min'], out['min']   = t_min, v_min
+    out['t_fast'], out['fast'] = t_fast, v_fast
+    out['t_slow'], out['slow'] = t_slow, v_slow
+    out['baseline'], out['rms'] = bl[rows, 0], rms[rows, 0]
+    return out
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# Shared-memory transport of decoded events between processes.
+# The reader copies batches of waveforms, matrix defined as
+# (event, channel, sample), into a ring of shared memory blocks and sends
+# only a small descriptor through the queues. Workers map the block as a
+# numpy array without copying and release it when done.
+
+from collections import namedtuple
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import os
+
+# header table, one row per event of a block
+HEADER_DTYPE = np.dtype([('midas_event',   'i8'),
+                         ('event_counter', 'u8'),
+                         ('trigger_time',  'u8'),
+                         ('channel_mask',  'u8')])
+
+# what travels through the queues instead of the waveforms
+BlockDescriptor = namedtuple('BlockDescriptor', ['block', 'shape', 'dtype', 'headers'])
+
+
+# Return the header table of a list of unpacked events (see midas_liverpool.py)
+def get_headers(events):
+  headers = np.empty(len(events), dtype=HEADER_DTYPE)
+  for i, ev in enumerate(events):
+    headers[i] = (ev.midas_event, ev.event_counter, ev.trigger_time, ev.channel_mask)
+  return headers
+
+
+# Group consecutive non-empty events with the same waveform shape
+# into lists of at most batch_size events
+def get_batches(events, batch_size=100):
+  batch = []
+  for ev in events:
+    if ev is None or ev.nchannels == 0: continue
+    if batch and (len(batch) == batch_size or ev.adc_data.shape != batch[0].adc_data.shape):
+      yield batch
+      batch = []
+    batch.append(ev)
+  if batch: yield batch
+
+
+class SharedBlockRing:
+  """Ring of shared memory blocks holding event batches.
+  The free block indices circulate through a queue: writers wait for a free
+  block (backpressure on the reader), readers give it back with release().
+  The ring is passed to worker processes as a Process argument; workers
+  attach to the blocks by name on first use.
+  Usage:
+    ring = SharedBlockRing(nblocks=8, block_bytes=64<<20)
+    # reader process
+    for batch in get_batches(reader):
+      tasks.put(ring.write(batch))
+    # worker process
+    desc = tasks.get()
+    wfs  = ring.get(desc)   # (event, channel, sample) view, no copy
+    ...
+    del wfs
+    ring.release(desc)
+  """
+
+  def __init__(self, nblocks=8, block_bytes=64 << 20, ctx=mp):
+    """Constructor.
+    Args:
+      nblocks (int): number of blocks, i.e. batches in flight
+      block_bytes (int): size of each block in bytes
+      ctx: multiprocessing context used to create the free-block queue
+    """
+    self.block_bytes = block_bytes
+    self.blocks      = [shared_memory.SharedMemory(create=True, size=block_bytes) for _ in range(nblocks)]
+    self.names       = [b.name for b in self.blocks]
+    self.free        = ctx.Queue()
+    self.pid         = os.getpid()  # only the creating process unlinks the blocks
+    for i in range(nblocks): self.free.put(i)
+
+  def __getstate__(self):
+    return {'block_bytes': self.block_bytes, 'names': self.names, 'free': self.free, 'pid': self.pid}
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.blocks = [None]*len(self.names)
+
+  def _block(self, i):
+    if self.blocks[i] is None:
+      try:  # python >= 3.13, the creator alone is in charge of unlinking
+        self.blocks[i] = shared_memory.SharedMemory(name=self.names[i], track=False)
+      except TypeError:
+        self.blocks[i] = shared_memory.SharedMemory(name=self.names[i])
+    return self.blocks[i]
+
+  def _view(self, i, shape, dtype):
+    dtype = np.dtype(dtype)
+    if int(np.prod(shape))*dtype.itemsize > self.block_bytes:
+      raise ValueError(f'Batch of shape {shape} and dtype {dtype} does not fit in a {self.block_bytes} bytes block.')
+    return np.ndarray(shape, dtype=dtype, buffer=self._block(i).buf)
+
+  def put(self, wfs, headers=None, timeout=None):
+    """Copy an (event, channel, sample) array into a free block and return its descriptor.
+    Blocks until a block is free (queue.Empty is raised after timeout seconds).
+    """
+    i = self.free.get(timeout=timeout)
+    try:
+      self._view(i, wfs.shape, wfs.dtype)[...] = wfs
+    except Exception:
+      self.free.put(i)
+      raise
+    return BlockDescriptor(i, wfs.shape, wfs.dtype.str, headers)
+
+  def write(self, events, timeout=None):
+    """Copy the waveforms of a batch of unpacked events (same shape) into a free block.
+    Each event is copied once, straight into shared memory.
+    """
+    shape = (len(events),) + events[0].adc_data.shape
+    dtype = events[0].adc_data.dtype
+    i = self.free.get(timeout=timeout)
+    try:
+      dst = self._view(i, shape, dtype)
+      for k, ev in enumerate(events): dst[k] = ev.adc_data
+    except Exception:
+      self.free.put(i)
+      raise
+    return BlockDescriptor(i, shape, np.dtype(dtype).str, get_headers(events))
+
+  def get(self, desc):
+    """Return the waveforms of a descriptor as an array mapped on the shared block.
+    The array must be deleted before the block is released or the ring closed.
+    """
+    return self._view(desc.block, desc.shape, desc.dtype)
+
+  def release(self, desc):
+    """Give the block of a descriptor back to the writer."""
+    self.free.put(desc.block)
+
+  def close(self):
+    """Detach from the blocks, and free them if this is the creating process."""
+    for i, b in enumerate(self.blocks):
+      if b is None: continue
+      b.close()
+      if os.getpid() == self.pid: b.unlink()
+      self.blocks[i] = None
+
+
+# Worker loop: apply func(wfs, headers) to every descriptor received on tasks
+# until None, putting (headers, func output) on results.
+# An exception raised by func is put on results in place of its output.
+# func must not keep references to wfs: the block is released before the
+# result is queued and may already hold another batch when it is read.
+def serve(ring, tasks, results, func):
+  try:
+    while True:
+      desc = tasks.get()
+      if desc is None: break
+      wfs = ring.get(desc)
+      try:
+        out = func(wfs, desc.headers)
+      except Exception as exc:
+        out = exc
+      finally:
+        del wfs
+        ring.release(desc)
+      results.put((desc.headers, out))
+  finally:
+    ring.close()
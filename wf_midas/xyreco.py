@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Position (xy) reconstruction on the PDM grid, see the [xyreco] section.
+# Channel charges of a batch, matrix defined as (event, channel), are
+# placed on the (m_pdms, n_pdms) grid with a compiled ChannelMap.
+# Lit PDMs are clustered with a DBSCAN working on grid neighbours (fixed
+# offsets, no pairwise distances) and the position is the charge-weighted
+# barycenter of the selected cluster. All events are processed at once.
+
+import numpy as np
+from mapping import ChannelMap
+
+# xy table returned by XYReco.reco, one row per event (positions in PDM units)
+XY_DTYPE = np.dtype([('x',     'f4'),
+                     ('y',     'f4'),
+                     ('q',     'f8'),   # charge of the selected cluster
+                     ('frac',  'f4'),   # fraction of the event charge in the cluster
+                     ('npdms', 'i2')])  # number of PDMs in the cluster
+
+
+class XYReco:
+  """Grid DBSCAN xy reconstruction.
+  Usage:
+    xy = XYReco(m_pdms=5, n_pdms=5, eps=1, min_frac=0.03)
+    pos = xy.reco(charges)  # charges (event, channel) -> XY_DTYPE array (event,)
+  """
+
+  def __init__(self, m_pdms=5, n_pdms=5, eps=1, min_frac=0.03, is_max_chan=True, min_pdms=1, mapping=None):
+    """Constructor.
+    Args:
+      m_pdms, n_pdms (int): grid rows and columns
+      eps (float): DBSCAN neighbourhood radius in PDMs
+      min_frac (float): minimum fraction of the event charge for a PDM to be lit
+      is_max_chan (bool): select the cluster with the brightest PDM, else the one with the largest charge
+      min_pdms (int): DBSCAN minimum number of lit PDMs (including itself) in the neighbourhood of a core PDM
+      mapping (ChannelMap, None): channel -> PDM map, None for PDM i (row-major) read by channel i
+    """
+    self.shape       = (m_pdms, n_pdms)
+    self.min_frac    = min_frac
+    self.is_max_chan = is_max_chan
+    self.min_pdms    = min_pdms
+
+    self.mapping     = ChannelMap.identity(m_pdms, n_pdms) if mapping is None else mapping
+
+    # neighbour offsets within eps, excluding the PDM itself
+    r = int(np.floor(eps))
+    self.offsets = [(i, j) for i in range(-r, r+1) for j in range(-r, r+1) if 0 < i*i + j*j <= eps*eps]
+
+    rows, cols = np.indices(self.shape)
+    self.rows, self.cols = rows.astype(float), cols.astype(float)
+
+  # Shift (event, m, n) images by (di, dj) with 'fill' entering from the border
+  @staticmethod
+  def __shift(a, di, dj, fill):
+    out = np.full_like(a, fill)
+    m, n = a.shape[1:]
+    out[:, max(di,0):m+min(di,0), max(dj,0):n+min(dj,0)] = a[:, max(-di,0):m-max(di,0), max(-dj,0):n-max(dj,0)]
+    return out
+
+  # Return the DBSCAN labels (event, m, n) of lit PDMs, -1 for noise
+  def get_labels(self, lit):
+    nevs, m, n = lit.shape
+    count = lit.astype(int)
+    for di, dj in self.offsets: count += self.__shift(lit, di, dj, False)
+    core = lit & (count >= self.min_pdms)
+
+    # connected components of core PDMs: propagate the minimum flat index
+    # (at most m*n iterations, each one vectorized over the batch)
+    big    = nevs*m*n
+    labels = np.where(core, np.arange(big).reshape(lit.shape), big)
+    while True:
+      new = labels
+      for di, dj in self.offsets: new = np.minimum(new, self.__shift(labels, di, dj, big))
+      new = np.where(core, new, big)
+      if np.array_equal(new, labels): break
+      labels = new
+
+    # border PDMs join the cluster of a neighbouring core PDM
+    border = labels
+    for di, dj in self.offsets: border = np.minimum(border, self.__shift(labels, di, dj, big))
+    labels = np.where(lit & ~core, border, labels)
+    return np.where(labels < big, labels, -1)
+
+  def reco(self, q):
+    """Return the xy positions (XY_DTYPE) of a batch of channel charges (event, channel)."""
+    img   = self.mapping.images(q)
+    nevs  = len(img)
+    tot   = img.reshape(nevs, -1).sum(axis=1)
+    lit   = img > self.min_frac*tot.reshape(-1, 1, 1)
+    label = self.get_labels(lit).reshape(nevs, -1)
+    flat  = img.reshape(nevs, -1)
+
+    # selected cluster: the one of the brightest lit PDM, or the one with the largest charge
+    if self.is_max_chan:
+      best = np.argmax(np.where(label >= 0, flat, -np.inf), axis=1)
+    else:
+      ids  = np.where(label >= 0, label, nevs*flat.shape[1])
+      cq   = np.bincount(ids.reshape(-1), weights=flat.reshape(-1), minlength=nevs*flat.shape[1]+1)
+      best = np.argmax(np.where(label >= 0, cq[ids], -np.inf), axis=1)
+    sel = (label == label[np.arange(nevs), best].reshape(-1, 1)) & (label >= 0)
+
+    w   = np.where(sel, flat, 0)
+    cq  = w.sum(axis=1)
+    pos = np.zeros(nevs, dtype=XY_DTYPE)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      pos['x']    = w @ self.cols.reshape(-1)/cq
+      pos['y']    = w @ self.rows.reshape(-1)/cq
+      pos['frac'] = cq/tot
+    pos['q'], pos['npdms'] = cq, sel.sum(axis=1)
+    return pos